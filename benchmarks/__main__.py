@@ -0,0 +1,75 @@
+"""
+Run the repviz benchmark suite.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --compare results.json --threshold 0.15
+
+Every case is timed over `--repeat` runs (median / min / IQR) and its peak
+memory measured once: resident memory (`rss_peak_bytes`, torch tensors
+included) and Python/NumPy allocations (`python_peak_bytes`). With
+`--compare` the new run is checked against a previous JSON file and the
+exit code is 1 if any case regressed by more than `--threshold`.
+"""
+
+import re
+import sys
+import argparse
+import warnings
+
+import torch
+
+from .harness import compare, environment, format_comparison, load, measure, save
+from .scenarios import SCENARIOS, cases
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument(
+        "--metric",
+        default="median",
+        choices=["median", "min", "rss_peak_bytes", "python_peak_bytes"],
+    )
+    parser.add_argument("--filter", help="regex selecting case names")
+    parser.add_argument("--quick", action="store_true", help="small parameter grid")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    device = torch.device(args.device)
+    results = {"environment": environment(), "cases": {}}
+
+    for name, scenario, params in cases(args.quick):
+        if args.filter and not re.search(args.filter, name):
+            continue
+
+        setup = SCENARIOS[scenario][0]
+        result = measure(
+            setup(**params, device=device),
+            repeat=args.repeat,
+            warmup=args.warmup,
+            device=device,
+            memory=not args.no_memory,
+        )
+        results["cases"][name] = dict(result, scenario=scenario, params=params)
+        print(f"{name:<60} {result['median'] * 1e3:10.2f} ms", flush=True)
+
+    if args.output:
+        save(results, args.output)
+
+    if args.compare:
+        rows = compare(load(args.compare), results, args.threshold, args.metric)
+        print(format_comparison(rows))
+        if any(row["status"] == "regression" for row in rows):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import gc
+import os
+import json
+import ctypes
+import platform
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+
+def _rss_reader() -> Optional[Callable[[], int]]:
+    """
+    Current resident set size of this process: psutil when installed,
+    otherwise `/proc/self/statm`; `None` where neither is available.
+    """
+    try:
+        import psutil
+
+        process = psutil.Process()
+        return lambda: process.memory_info().rss
+    except ImportError:
+        pass
+
+    if not os.path.exists("/proc/self/statm"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def read() -> int:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * page_size
+
+    return read
+
+
+def _release_heap() -> None:
+    """
+    Collect garbage and hand freed heap pages back to the OS (glibc), so a
+    following call's allocations show up in RSS instead of reusing them.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _rss_peak(fn: Callable[[], Any], interval: float = 1e-3) -> Optional[int]:
+    """
+    Peak RSS above the starting RSS during one call of `fn`, sampled from a
+    background thread every `interval` seconds. Unlike `tracemalloc` this
+    sees torch's CPU allocator, i.e. tensors and captures.
+    """
+    read = _rss_reader()
+    if read is None:
+        return None
+
+    _release_heap()
+    base = peak = read()
+    done = threading.Event()
+
+    def sample() -> None:
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, read())
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        thread.join()
+
+    return max(peak, read()) - base
+
+
+def _peak_memory(fn: Callable[[], Any], device: torch.device) -> Dict[str, int]:
+    """
+    Peak memory of `fn`, each from its own call:
+
+    - `rss_peak_bytes`: host resident memory, tensors included,
+    - `python_peak_bytes`: Python and NumPy allocations traced by
+      `tracemalloc`, which does not see torch tensors,
+    - `device_peak_bytes`: on CUDA, the peak device allocation.
+    """
+    memory = {}
+    rss = _rss_peak(fn)
+    if rss is not None:
+        memory["rss_peak_bytes"] = rss
+
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+
+    tracemalloc.start()
+    fn()
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    memory["python_peak_bytes"] = python_peak
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        memory["device_peak_bytes"] = torch.cuda.max_memory_allocated(device) - base
+
+    return memory
+
+
+def measure(
+    fn: Callable[[], Any],
+    repeat: int = 5,
+    warmup: int = 1,
+    device: torch.device = torch.device("cpu"),
+    memory: bool = True,
+) -> Dict[str, Any]:
+    """
+    Wall-clock timings of `repeat` calls of `fn` after `warmup` calls, and
+    the peak memory of extra, separately measured calls (see `_peak_memory`;
+    sampling and tracing never overlap the timed runs).
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    result = {
+        "times": times,
+        "median": float(np.median(times)),
+        "min": float(np.min(times)),
+        "iqr": float(np.subtract(*np.percentile(times, [75, 25]))),
+    }
+    if memory:
+        result.update(_peak_memory(fn, device))
+
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+    }
+
+
+def save(results: Dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.1,
+    metric: str = "median",
+) -> List[Dict[str, Any]]:
+    """
+    Ratio `current / baseline` of `metric` for every case present in both
+    runs. A case is a regression when the ratio exceeds `1 + threshold` and
+    an improvement when it is below `1 / (1 + threshold)`.
+    """
+    rows = []
+    for case, result in current["cases"].items():
+        base = baseline["cases"].get(case)
+        if base is None or metric not in base or metric not in result:
+            continue
+
+        ratio = result[metric] / max(base[metric], 1e-12)
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows.append(
+            {
+                "case": case,
+                "baseline": base[metric],
+                "current": result[metric],
+                "ratio": ratio,
+                "status": status,
+            }
+        )
+
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    width = max([len(row["case"]) for row in rows] + [4])
+    lines = [f"{'case':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>6}"]
+    for row in rows:
+        lines.append(
+            f"{row['case']:<{width}}  {row['baseline']:>10.4g}  "
+            f"{row['current']:>10.4g}  {row['ratio']:>6.2f}  {row['status']}"
+        )
+
+    return "\n".join(lines)
@@ -0,0 +1,239 @@
+import os
+import sys
+import inspect
+import subprocess
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+from repviz import models
+from repviz.hooks import HookManager
+from repviz.inference import run_inference
+from repviz.plots import plot_cka
+from repviz.registry import Registry
+from repviz.tools import cka, decomposition, gram_linear
+
+N_FEATS = 10
+N_CLASSES = 3
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backends only loaded on first use; importing any of IMPORT_TARGETS must not
+# pull them in
+HEAVY_MODULES = ("matplotlib", "seaborn", "pandas", "sklearn")
+IMPORT_TARGETS = (
+    "repviz",
+    "repviz.inference",
+    "repviz.tools",
+    "repviz.attention",
+    "repviz.plots",
+)
+
+MODELS = {
+    name: cls
+    for name, cls in inspect.getmembers(models, inspect.isclass)
+    if issubclass(cls, torch.nn.Module)
+    and cls.__module__ == models.__name__
+    and "n_feats" in inspect.signature(cls).parameters
+}
+MODELS["TinyTabularAttentionModel"] = models.TinyTabularAttentionModel
+
+
+def _build(name: str) -> torch.nn.Module:
+    cls = MODELS[name]
+    if name == "TinyTabularAttentionModel":
+        return cls(input_dim=N_FEATS, num_classes=N_CLASSES)
+
+    return cls(N_FEATS, N_CLASSES)
+
+
+def _data(n: int, dim: int = N_FEATS, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim), dtype=np.float32)
+
+
+def _layers(n: int, n_layers: int, dim: int = 64) -> Dict[str, np.ndarray]:
+    return {f"Linear:{i}": _data(n, dim, seed=i) for i in range(n_layers)}
+
+
+def forward(model: str, n: int, device: torch.device) -> Callable[[], Any]:
+    net = _build(model).to(device).eval()
+    x = torch.as_tensor(_data(n), device=device)
+
+    def run():
+        with torch.no_grad():
+            net(x)
+
+    return run
+
+
+def hooked_forward(model: str, n: int, device: torch.device) -> Callable[[], Any]:
+    net = _build(model).to(device).eval()
+    x = torch.as_tensor(_data(n), device=device)
+    manager = HookManager(track_all=True)
+    manager.register_hooks(net, partial_matches=["ALL"])
+
+    def run():
+        with torch.no_grad():
+            net(x)
+        manager.get_activations()
+        manager.reset()
+
+    return run
+
+
+def _inplace_stack(depth: int, dim: int = 64) -> torch.nn.Module:
+    layers = []
+    for _ in range(depth):
+        layers += [torch.nn.Linear(dim, dim), torch.nn.ReLU(inplace=True)]
+
+    return torch.nn.Sequential(*layers)
+
+
+def offloaded_forward(depth: int, n: int, device: torch.device) -> Callable[[], Any]:
+    """
+    Forward with `async_offload` through `Linear` -> `ReLU(inplace=True)`
+    blocks; fails if a capture differs from a synchronous capture, i.e. if an
+    offloaded copy saw the later in-place ReLU.
+    """
+    torch.manual_seed(0)
+    net = _inplace_stack(depth).to(device).eval()
+    x = torch.as_tensor(_data(n, 64), device=device)
+
+    def capture(manager: HookManager) -> Dict[str, torch.Tensor]:
+        with torch.no_grad():
+            net(x)
+        activations = {k: v.clone() for k, v in manager.get_activations().items()}
+        manager.reset()
+        return activations
+
+    reference = HookManager(track_all=True, capture=["activations"])
+    reference.register_hooks(net, module_types=["Linear"])
+    expected = capture(reference)
+    reference.clear_hooks()
+
+    manager = HookManager(track_all=True, async_offload=True, capture=["activations"])
+    manager.register_hooks(net, module_types=["Linear"])
+
+    def run():
+        activations = capture(manager)
+        for name, value in expected.items():
+            if not torch.equal(activations[name], value):
+                raise RuntimeError(f"async offload captured wrong values for {name}")
+
+    return run
+
+
+def inference(
+    n_models: int, n: int, batch_size: int, device: torch.device
+) -> Callable[[], Any]:
+    registry = Registry()
+    registry.register_model([_build(name) for name in list(MODELS)[:n_models]])
+    x = _data(n)
+    y = np.random.default_rng(0).integers(0, N_CLASSES, n)
+
+    return lambda: run_inference(registry, x, y, device=device, batch_size=batch_size)
+
+
+def cka_pair(n: int, device: torch.device) -> Callable[[], Any]:
+    gram_x = gram_linear(_data(n, 64, seed=0))
+    gram_y = gram_linear(_data(n, 64, seed=1))
+
+    return lambda: cka(gram_x, gram_y)
+
+
+def cka_plot(n: int, n_layers: int, device: torch.device) -> Callable[[], Any]:
+    acts1 = _layers(n, n_layers)
+    acts2 = _layers(n, n_layers)
+
+    return lambda: plot_cka(acts1, acts2, show=False)
+
+
+def pca(n: int, device: torch.device) -> Callable[[], Any]:
+    mat = _data(n, 512)
+
+    return lambda: decomposition(mat, 2, method="PCA", cache=False)
+
+
+def import_time(target: str, device: torch.device) -> Callable[[], Any]:
+    """
+    Import `target` in a fresh interpreter; fails if that loads any of
+    `HEAVY_MODULES`.
+    """
+    code = (
+        f"import sys, {target}\n"
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "sys.exit(f'loaded {loaded}' if loaded else 0)"
+    )
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+
+    def run():
+        proc = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, text=True
+        )
+        if proc.returncode:
+            raise RuntimeError(f"import {target}: {proc.stderr.strip()}")
+
+    return run
+
+
+# scenario name -> (setup, full parameter grid, quick parameter grid)
+SCENARIOS = {
+    "import": (
+        import_time,
+        [{"target": t} for t in IMPORT_TARGETS],
+        [{"target": t} for t in IMPORT_TARGETS],
+    ),
+    "forward": (
+        forward,
+        [{"model": m, "n": 1024} for m in MODELS],
+        [{"model": m, "n": 256} for m in MODELS],
+    ),
+    "hooked_forward": (
+        hooked_forward,
+        [{"model": m, "n": 1024} for m in MODELS],
+        [{"model": m, "n": 256} for m in MODELS],
+    ),
+    "offloaded_forward": (
+        offloaded_forward,
+        [{"depth": 20, "n": 1024}],
+        [{"depth": 20, "n": 256}],
+    ),
+    "run_inference": (
+        inference,
+        [
+            {"n_models": k, "n": 4096, "batch_size": b}
+            for k in (1, 4)
+            for b in (None, 256, 1024)
+        ],
+        [{"n_models": k, "n": 512, "batch_size": 128} for k in (1, 2)],
+    ),
+    "cka": (
+        cka_pair,
+        [{"n": n} for n in (256, 1024, 4096)],
+        [{"n": n} for n in (128, 512)],
+    ),
+    "plot_cka": (
+        cka_plot,
+        [{"n": n, "n_layers": k} for n in (512, 2048) for k in (4, 16)],
+        [{"n": 256, "n_layers": 4}],
+    ),
+    "decomposition": (
+        pca,
+        [{"n": n} for n in (1000, 10000, 50000)],
+        [{"n": n} for n in (500, 2000)],
+    ),
+}
+
+
+def case_name(scenario: str, params: Dict[str, Any]) -> str:
+    return scenario + "".join(f"[{k}={v}]" for k, v in params.items())
+
+
+def cases(quick: bool = False) -> List[tuple]:
+    """
+    `(case name, scenario, params)` for every benchmark case.
+    """
+    return [
+        (case_name(scenario, params), scenario, params)
+        for scenario, (_, full, short) in SCENARIOS.items()
+        for params in (short if quick else full)
+    ]
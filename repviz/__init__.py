@@ -1,5 +1,50 @@
-from .registry import Registry
-from .inference import run_inference
+from importlib import import_module
+
+# public name -> submodule defining it; everything is imported on first
+# access, so `import repviz` stays cheap and headless workers never load the
+# plotting or scikit-learn backends
+_LAZY_ATTRS = {
+    "Registry": "registry",
+    "run_inference": "inference",
+}
+_SUBMODULES = {
+    "attention",
+    "buffers",
+    "cache",
+    "drift",
+    "gradients",
+    "hooks",
+    "index",
+    "inference",
+    "models",
+    "offload",
+    "plots",
+    "precision",
+    "profiler",
+    "projection",
+    "registry",
+    "resampling",
+    "stats",
+    "store",
+    "tools",
+    "utils",
+}
 
 
 __all__ = ["Registry", "run_inference"]
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(import_module(f".{_LAZY_ATTRS[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS) | _SUBMODULES)
@@ -0,0 +1,178 @@
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from .hooks import HookManager
+from .inference import BatchAccumulator, _num_samples, iter_batches
+
+Array = Union[torch.Tensor, np.ndarray]
+
+
+def _to_numpy(x: Array) -> np.ndarray:
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+
+    return np.asarray(x)
+
+
+def attention_entropy(attn: Array, eps: float = 1e-12) -> np.ndarray:
+    """
+    Shannon entropy (nats) of every attention row; `attn` is `(..., T, T)`
+    with rows summing to one, the result is `(..., T)`.
+    """
+    attn = _to_numpy(attn)
+    return -(attn * np.log(attn + eps)).sum(axis=-1)
+
+
+def attention_topk(attn: Array, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices and weights of the `k` most attended keys of every query,
+    ordered by decreasing weight, both `(..., T, k)`. Uses `argpartition`,
+    so only the `k` selected keys are sorted.
+    """
+    attn = _to_numpy(attn)
+    k = min(k, attn.shape[-1])
+    indices = np.argpartition(-attn, k - 1, axis=-1)[..., :k]
+    values = np.take_along_axis(attn, indices, axis=-1)
+    order = np.argsort(-values, axis=-1)
+
+    return (
+        np.take_along_axis(indices, order, axis=-1),
+        np.take_along_axis(values, order, axis=-1),
+    )
+
+
+def attention_sparsity(attn: Array, threshold: float) -> np.ndarray:
+    """
+    Fraction of keys with weight below `threshold`, per query: `(..., T)`.
+    """
+    return (_to_numpy(attn) < threshold).mean(axis=-1)
+
+
+class AttentionStats:
+    """
+    Streaming summary of attention maps `(..., heads, T, T)`; all leading
+    axes (calls, samples) are treated as samples. Memory is O(heads * T^2)
+    however many samples are seen:
+
+    - mean attention map per head,
+    - mean entropy and thresholded sparsity per head and query,
+    - how often each key is among the `k` most attended keys of a query.
+    """
+
+    def __init__(self, k: int = 3, threshold: float = 0.1) -> None:
+        self.k = k
+        self.threshold = threshold
+        self.count = 0
+        self._map = None
+        self._entropy = None
+        self._sparsity = None
+        self._topk = None
+
+    def update(self, attn: Array) -> None:
+        attn = _to_numpy(attn)
+        t = attn.shape[-1]
+        attn = attn.reshape(-1, *attn.shape[-3:]).astype(np.float64)
+        n = attn.shape[0]
+        if n == 0:
+            return
+
+        if self._map is None:
+            self._map = np.zeros(attn.shape[1:])
+            self._entropy = np.zeros(attn.shape[1:-1])
+            self._sparsity = np.zeros(attn.shape[1:-1])
+            self._topk = np.zeros(attn.shape[1:], dtype=np.int64)
+
+        self._map += attn.sum(axis=0)
+        self._entropy += attention_entropy(attn).sum(axis=0)
+        self._sparsity += attention_sparsity(attn, self.threshold).sum(axis=0)
+
+        indices, _ = attention_topk(attn, self.k)
+        rows = np.arange(self._topk.shape[0] * self._topk.shape[1])
+        rows = rows.reshape(1, *self._topk.shape[:2], 1)
+        flat = (rows * t + indices).ravel()
+        self._topk += np.bincount(flat, minlength=self._topk.size).reshape(
+            self._topk.shape
+        )
+        self.count += n
+
+    @property
+    def mean_map(self) -> np.ndarray:
+        return self._map / self.count
+
+    @property
+    def entropy(self) -> np.ndarray:
+        return self._entropy / self.count
+
+    @property
+    def sparsity(self) -> np.ndarray:
+        return self._sparsity / self.count
+
+    @property
+    def topk_frequency(self) -> np.ndarray:
+        """
+        `(heads, T, T)`: fraction of samples in which key `j` was among the
+        top-`k` keys of query `i`.
+        """
+        return self._topk / self.count
+
+    def summary(self) -> Dict[str, np.ndarray]:
+        return {
+            "count": self.count,
+            "mean_map": self.mean_map,
+            "entropy": self.entropy,
+            "sparsity": self.sparsity,
+            "topk_frequency": self.topk_frequency,
+        }
+
+
+def capture_attention(
+    model: nn.Module,
+    data: Union[np.ndarray, torch.Tensor, DataLoader],
+    batch_size: Optional[int] = None,
+    device: Union[torch.device, str] = "cpu",
+    module_types: Sequence[Union[type, str]] = ("AttentionScore",),
+    summarize: bool = False,
+    k: int = 3,
+    threshold: float = 0.1,
+) -> Dict[str, Union[torch.Tensor, AttentionStats]]:
+    """
+    Run `model` over `data` and capture the output of every attention-score
+    module (`module_types`), keyed by `Type:idx` like `run_inference`.
+
+    By default the maps of all batches are concatenated along the sample
+    axis, `(n_calls, n_samples, heads, T, T)`. With `summarize=True` each
+    batch is folded into an `AttentionStats` instead and only the summaries
+    are kept.
+    """
+    device = torch.device(device)
+    model.eval()
+    hook_mgr = HookManager(track_all=True, capture=["activations"])
+    hook_mgr.register_hooks(model, module_types=module_types)
+
+    if summarize:
+        maps = {}
+    else:
+        maps = BatchAccumulator(_num_samples(data), dim=1)
+
+    try:
+        for ts_x, _ in iter_batches(data, None, batch_size):
+            with torch.no_grad():
+                model(ts_x.to(device))
+
+            captures = hook_mgr.get_activations()
+            if summarize:
+                for name, attn in captures.items():
+                    if name not in maps:
+                        maps[name] = AttentionStats(k=k, threshold=threshold)
+                    maps[name].update(attn)
+            else:
+                maps.update(captures)
+            hook_mgr.reset()
+    finally:
+        hook_mgr.clear_hooks()
+
+    return maps if summarize else maps.result()
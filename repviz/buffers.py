@@ -0,0 +1,101 @@
+from typing import Optional
+
+import torch
+
+from .offload import Offloader
+
+
+class CaptureBuffer:
+    """
+    Preallocated host storage for repeated captures of one layer.
+
+    The backing tensor is allocated after the first capture, once the
+    per-call shape is known, and captures are copied into consecutive slots.
+
+    - `max_captures=None`: arena mode, the buffer grows geometrically
+      starting from `capacity` slots.
+    - `max_captures=N`: ring mode, only the last N captures are kept and
+      memory stays flat however long the run is.
+
+    `view()` returns a view of the filled slots without copying, except for
+    a ring buffer that has wrapped around, which is reordered oldest first.
+
+    With an `offloader` the slot copies are asynchronous and the buffer is
+    pinned when captures come from an accelerator; `view()` waits for them.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 8,
+        max_captures: Optional[int] = None,
+        offloader: Optional[Offloader] = None,
+    ) -> None:
+        if max_captures is not None and max_captures <= 0:
+            raise ValueError("max_captures must be a positive integer.")
+
+        self.capacity = max_captures or capacity
+        self.max_captures = max_captures
+        self.offloader = offloader
+        self.data = None
+        self.count = 0
+
+    def __len__(self) -> int:
+        if self.max_captures is None:
+            return self.count
+
+        return min(self.count, self.max_captures)
+
+    def _allocate(self, sample: torch.Tensor, capacity: int) -> torch.Tensor:
+        return torch.empty(
+            (capacity, *sample.shape),
+            dtype=sample.dtype,
+            pin_memory=self.offloader is not None and sample.is_cuda,
+        )
+
+    def append(self, tensor: torch.Tensor) -> None:
+        if self.data is None or (
+            self.count == 0 and self.data.shape[1:] != tensor.shape
+        ):
+            self.data = self._allocate(tensor, self.capacity)
+        elif self.data.shape[1:] != tensor.shape:
+            raise ValueError(
+                f"Capture shape {tuple(tensor.shape)} does not match "
+                f"buffered shape {tuple(self.data.shape[1:])}."
+            )
+
+        if self.max_captures is not None:
+            slot = self.count % self.max_captures
+        else:
+            slot = self.count
+            if slot == self.data.shape[0]:
+                self._synchronize()
+                grown = self._allocate(tensor, 2 * self.data.shape[0])
+                grown[:slot].copy_(self.data)
+                self.data = grown
+
+        if self.offloader is not None:
+            self.offloader.copy_(self.data[slot], tensor)
+        else:
+            self.data[slot].copy_(tensor)
+        self.count += 1
+
+    def _synchronize(self) -> None:
+        if self.offloader is not None:
+            self.offloader.synchronize()
+
+    def view(self) -> torch.Tensor:
+        self._synchronize()
+        n = len(self)
+
+        if self.max_captures is None or self.count <= self.max_captures:
+            return self.data[:n]
+
+        start = self.count % self.max_captures
+        return torch.cat([self.data[start:], self.data[:start]])
+
+    def clear(self) -> None:
+        """
+        Forget the stored captures but keep the allocation for reuse.
+        """
+        self._synchronize()
+        self.count = 0
@@ -0,0 +1,98 @@
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+import numpy as np
+import torch
+
+
+def fingerprint(x: Union[torch.Tensor, np.ndarray]) -> str:
+    """
+    Content hash of an array: shape, dtype and raw bytes.
+    """
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    x = np.ascontiguousarray(x)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{x.shape}{x.dtype.str}".encode())
+    digest.update(memoryview(x).cast("B"))
+    return digest.hexdigest()
+
+
+class GramCache:
+    """
+    Size-bounded LRU cache for Gram and centered-Gram matrices, keyed by
+    content fingerprint, so e.g. a fixed baseline model is only processed
+    once across many `cka` / `cka_matrix` calls.
+
+    Entries beyond `max_bytes` are evicted least recently used first; with
+    `spill_dir` they are written there as `.npy` and memory-mapped back on
+    the next hit instead of being recomputed.
+    """
+
+    def __init__(self, max_bytes: int = 2**30, spill_dir: Optional[str] = None) -> None:
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries or (
+            self.spill_dir is not None and os.path.exists(self._spill_path(key))
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.spill_dir is not None and os.path.exists(self._spill_path(key)):
+            value = np.load(self._spill_path(key), mmap_mode="r")
+            self.put(key, value)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Union[torch.Tensor, np.ndarray]) -> None:
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+        self.entries[key] = value
+        self.nbytes += value.nbytes
+
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.nbytes -= old_value.nbytes
+            if self.spill_dir is not None and not os.path.exists(
+                self._spill_path(old_key)
+            ):
+                if isinstance(old_value, torch.Tensor):
+                    old_value = old_value.detach().cpu().numpy()
+                np.save(self._spill_path(old_key), old_value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.nbytes = 0
@@ -0,0 +1,132 @@
+from typing import Any, Dict, Optional, Pattern, Sequence, Union
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from .hooks import HookManager
+from .inference import BatchAccumulator, _num_samples, iter_batches
+from .tools import _normalized_centered_grams
+
+
+class CKADriftTracker:
+    """
+    Representation drift across training checkpoints on a fixed probe set.
+
+    Linear CKA between two checkpoints of a layer is the inner product of
+    their normalized centered Gram matrices over the probe samples, so that
+    `n_probe x n_probe` matrix is a sufficient statistic for comparing the
+    layer with any other checkpoint. Each `update` captures the probe
+    activations through `HookManager`, reduces every layer to its Gram, drops
+    the activations and compares with the reference (first, or last
+    `reset_reference`) and the previous checkpoint. Memory is two Grams per
+    layer, independent of layer width and of the number of checkpoints.
+
+    `paths`, `module_types` and `pattern` select the tracked layers, see
+    `HookManager.register_hooks`; layers are keyed by `Type:idx`.
+    """
+
+    def __init__(
+        self,
+        probe: Union[np.ndarray, torch.Tensor, DataLoader],
+        batch_size: Optional[int] = None,
+        device: Union[torch.device, str] = "cpu",
+        debiased: bool = False,
+        dtype: Optional[str] = None,
+        paths: Optional[Sequence[str]] = None,
+        module_types: Optional[Sequence[Union[type, str]]] = None,
+        pattern: Optional[Union[str, Pattern]] = None,
+    ) -> None:
+        self.probe = probe
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.debiased = debiased
+        self.dtype = dtype
+        self.selectors = dict(paths=paths, module_types=module_types, pattern=pattern)
+        self.reference = None
+        self.previous = None
+        self.steps = []
+        self.history = []
+
+    @torch.no_grad()
+    def _grams(self, model: nn.Module) -> Dict[str, torch.Tensor]:
+        hook_mgr = HookManager(track_all=True, capture=["activations"])
+        hook_mgr.register_hooks(model, **self.selectors)
+        activations = BatchAccumulator(_num_samples(self.probe), dim=1)
+
+        training = model.training
+        model.eval()
+        try:
+            for ts_x, _ in iter_batches(self.probe, None, self.batch_size):
+                model(ts_x.to(self.device))
+                activations.update(hook_mgr.get_activations())
+                hook_mgr.reset()
+        finally:
+            hook_mgr.clear_hooks()
+            model.train(training)
+
+        activations = activations.result()
+        grams = {}
+        for name in list(activations):
+            # one layer at a time, so only a single n x n Gram is in flight
+            x = activations.pop(name).to(self.device)
+            grams[name] = _normalized_centered_grams(
+                [x], self.debiased, dtype=self.dtype
+            )[0]
+
+        return grams
+
+    @staticmethod
+    def _compare(
+        grams: Dict[str, torch.Tensor], other: Optional[Dict[str, torch.Tensor]]
+    ) -> Dict[str, float]:
+        if other is None:
+            return {}
+
+        return {
+            name: float(gram.dot(other[name]))
+            for name, gram in grams.items()
+            if name in other
+        }
+
+    def update(self, model: nn.Module, step: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Add a checkpoint; returns `{"step", "reference", "previous"}` where
+        the last two map layer names to CKA. The first checkpoint becomes the
+        reference (CKA 1 with itself) and has no `"previous"` values.
+        """
+        grams = self._grams(model)
+        if self.reference is None:
+            self.reference = grams
+
+        record = {
+            "step": len(self.steps) if step is None else step,
+            "reference": self._compare(grams, self.reference),
+            "previous": self._compare(grams, self.previous),
+        }
+        self.previous = grams
+        self.steps.append(record["step"])
+        self.history.append(record)
+
+        return record
+
+    def reset_reference(self) -> None:
+        """
+        Use the latest checkpoint as the new reference.
+        """
+        self.reference = self.previous
+
+    def table(self, against: str = "reference") -> Dict[str, np.ndarray]:
+        """
+        Per-layer CKA series against `"reference"` or `"previous"`, aligned
+        with `steps` (NaN where a checkpoint had no value).
+        """
+        layers = []
+        for record in self.history:
+            layers.extend(k for k in record[against] if k not in layers)
+
+        return {
+            name: np.array([r[against].get(name, np.nan) for r in self.history])
+            for name in layers
+        }
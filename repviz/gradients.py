@@ -0,0 +1,58 @@
+from typing import Callable, Dict, Optional
+
+import torch
+from torch import nn
+from torch.func import functional_call, grad, vmap
+
+from .index import get_model_index
+
+LossFn = Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+
+
+def parameter_aliases(model: nn.Module) -> Dict[str, str]:
+    """
+    Qualified parameter name -> `Type:idx.param` key, matching the keys of
+    captured weights and `utils.get_model_info`.
+    """
+    index = get_model_index(model)
+    aliases = {}
+    for name, _ in model.named_parameters():
+        module_name, _, param = name.rpartition(".")
+        entry = index.by_name.get(module_name)
+        aliases[name] = f"{entry.alias}.{param}" if entry is not None else name
+
+    return aliases
+
+
+def per_sample_grad_norms(
+    model: nn.Module,
+    x: torch.Tensor,
+    y: torch.Tensor,
+    loss_fn: LossFn,
+    chunk_size: Optional[int] = None,
+) -> Dict[str, torch.Tensor]:
+    """
+    L2 norm of the gradient of `loss_fn` for every sample of the batch with
+    respect to every trainable parameter, `{Type:idx.param: (batch,)}`.
+
+    Gradients are computed with `torch.func` (`vmap` over `grad` of a
+    single-sample loss through `functional_call`), so the batch is one
+    vectorized backward rather than a Python loop; only the norms are kept.
+    `chunk_size` bounds how many samples `vmap` processes at once.
+    """
+    params = {k: p.detach() for k, p in model.named_parameters() if p.requires_grad}
+    buffers = {k: b.detach() for k, b in model.named_buffers()}
+
+    def sample_loss(params, x, y):
+        output = functional_call(model, (params, buffers), (x.unsqueeze(0),))
+        return loss_fn(output, y.unsqueeze(0))
+
+    grads = vmap(grad(sample_loss), in_dims=(None, 0, 0), chunk_size=chunk_size)(
+        params, x, y
+    )
+    aliases = parameter_aliases(model)
+
+    return {
+        aliases[k]: torch.linalg.vector_norm(g.flatten(1), dim=1).cpu()
+        for k, g in grads.items()
+    }
@@ -1,125 +1,406 @@
+import re
 from collections import defaultdict
-from typing import Callable, Dict, List
+from contextlib import contextmanager
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import torch
 from torch import nn
 
+from .buffers import CaptureBuffer
+from .index import get_model_index
+from .offload import Offloader
+from .precision import (
+    StorageDtype,
+    dequantize_per_channel,
+    quantize_per_channel,
+    resolve_storage_dtype,
+)
+from .profiler import LayerProfiler
+from .stats import RunningStats
+
+CAPTURE_KINDS = ("activations", "inputs", "gradients", "weights")
+
 
 class HookManager:
-    def __init__(self, track_all: bool = False) -> None:
+    """
+    `capture` selects what the hooks record, any of `CAPTURE_KINDS`. Forward
+    hooks are only installed for activations/inputs and backward hooks only
+    for gradients; weights are referenced at registration and only copied
+    to the host on the first `get_weights` call, so later training does not
+    change the snapshot.
+
+    With `track_all=True` every forward/backward call is copied into a
+    per-layer `CaptureBuffer`; `max_captures` turns those into ring buffers
+    that keep only the most recent calls.
+
+    `async_offload=True` moves the device-to-host copies off the hot path
+    (see `Offloader`); captures are materialized when a getter is called.
+
+    `stats=True` keeps only streaming per-channel summaries (`RunningStats`,
+    configured by `stats_options`) instead of the captured tensors; they
+    accumulate across calls and are read with `get_stats`.
+
+    Sampling bounds the cost of long runs: only every `call_stride`-th call
+    of a layer is recorded, `rows_per_call` keeps a uniform random subset of
+    rows (dim 0) of each recorded call, and recording stops once a layer
+    holds `max_samples` rows (with `track_all`, a call that does not fit
+    whole is dropped so captures keep one shape). Calls that are not due
+    return before anything is detached or copied. The decision is made in
+    the forward pass and reused by the matching backward call, so sampled
+    gradients pair row for row with the sampled activations and inputs.
+
+    `storage_dtype` stores captures at reduced precision: a float dtype
+    (`torch.float16`/`"bf16"`, ...) is cast on the device before the copy,
+    `"int8"` quantizes per channel (last axis) with one scale per call. The
+    getters dequantize transparently; `get_quantized` returns the raw data.
+
+    `profile=True` also times every hooked module and records its output
+    bytes and peak-allocation delta (see `LayerProfiler`), independently of
+    `capture`; the per-layer table is read with `get_profile` and
+    accumulates across calls until `clear_profile`.
+    """
+
+    def __init__(
+        self,
+        track_all: bool = False,
+        max_captures: Optional[int] = None,
+        capacity: int = 8,
+        async_offload: bool = False,
+        stats: bool = False,
+        stats_options: Optional[Dict[str, Any]] = None,
+        capture: Sequence[str] = CAPTURE_KINDS,
+        call_stride: int = 1,
+        rows_per_call: Optional[int] = None,
+        max_samples: Optional[int] = None,
+        storage_dtype: StorageDtype = None,
+        profile: bool = False,
+    ) -> None:
+        unknown = set(capture) - set(CAPTURE_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown capture kinds: {sorted(unknown)}.")
+
+        self.capture = frozenset(capture)
         self.track_all = track_all
+        self.call_stride = call_stride
+        self.rows_per_call = rows_per_call
+        self.max_samples = max_samples
+        self.sampling = call_stride > 1 or bool(rows_per_call) or bool(max_samples)
+        self.call_counts = defaultdict(int)
+        self.sample_counts = defaultdict(int)
+        self.pending_rows = defaultdict(list)
+        self.storage_dtype = resolve_storage_dtype(storage_dtype)
+        self.stats = None
+        self.profiler = LayerProfiler() if profile else None
         self.hooks = []
-        self.activations = defaultdict(list) if track_all else {}
-        self.inputs = defaultdict(list) if track_all else {}
-        self.gradients = defaultdict(list) if track_all else {}
-        self.weights = defaultdict(list[str]) if track_all else {}
+        self.hooked_modules = []
+        self.offloader = Offloader() if async_offload else None
+        new_buffer = partial(
+            CaptureBuffer,
+            capacity=capacity,
+            max_captures=max_captures,
+            offloader=self.offloader,
+        )
+        self.activations = defaultdict(new_buffer) if track_all else {}
+        self.inputs = defaultdict(new_buffer) if track_all else {}
+        self.gradients = defaultdict(new_buffer) if track_all else {}
+        self.weights = {}
+        self.weight_modules = {}
+        self.captures = {
+            "activations": self.activations,
+            "inputs": self.inputs,
+            "gradients": self.gradients,
+        }
+        self.scales = {
+            kind: defaultdict(new_buffer) if track_all else {} for kind in self.captures
+        }
+
+        if stats:
+            new_stats = partial(RunningStats, **(stats_options or {}))
+            self.stats = {
+                kind: defaultdict(new_stats)
+                for kind in ("activations", "inputs", "gradients")
+            }
+
+    def _to_host(self, tensor: torch.Tensor) -> torch.Tensor:
+        if self.offloader is not None:
+            return self.offloader.to_host(tensor.detach())
+
+        return tensor.detach().cpu()
+
+    def _synchronize(self) -> None:
+        if self.offloader is not None:
+            self.offloader.synchronize()
+
+    def _store(self, kind: str, name: str, tensor: torch.Tensor) -> None:
+        if self.stats is not None:
+            self.stats[kind][name].update(tensor)
+            return
+
+        scale = None
+        if self.storage_dtype == "int8":
+            tensor, scale = quantize_per_channel(tensor)
+        elif self.storage_dtype is not None:
+            tensor = tensor.detach().to(self.storage_dtype)
+
+        if self.track_all:
+            self.captures[kind][name].append(tensor.detach())
+            if scale is not None:
+                self.scales[kind][name].append(scale)
+        else:
+            self.captures[kind][name] = self._to_host(tensor)
+            if scale is not None:
+                self.scales[kind][name] = self._to_host(scale)
+
+    def _sample(self, key: Tuple[str, str], n_rows: int) -> Tuple[bool, Any]:
+        """
+        Decide whether this call of `key` is recorded and which rows to keep;
+        `None` rows means all of them.
+        """
+        calls = self.call_counts[key]
+        self.call_counts[key] = calls + 1
+        if calls % self.call_stride:
+            return False, None
+
+        rows = None
+        if self.rows_per_call is not None and n_rows > self.rows_per_call:
+            rows = torch.randperm(n_rows)[: self.rows_per_call].sort().values
+            n_rows = self.rows_per_call
+
+        if self.max_samples is not None:
+            remaining = self.max_samples - self.sample_counts[key]
+            if remaining <= 0 or (self.track_all and n_rows > remaining):
+                return False, None
+            if n_rows > remaining:
+                rows = torch.arange(remaining) if rows is None else rows[:remaining]
+                n_rows = remaining
+
+        self.sample_counts[key] += n_rows
+        return True, rows
+
+    @staticmethod
+    def _take(tensor: torch.Tensor, rows: Optional[torch.Tensor]) -> torch.Tensor:
+        if rows is None:
+            return tensor
+
+        return tensor.index_select(0, rows.to(tensor.device))
 
     def _hook_fn(self, name: str) -> Callable:
+        activations = "activations" in self.capture
+        inputs = "inputs" in self.capture
+        gradients = "gradients" in self.capture
+
         def hook(module: nn.Module, input, output):
-            out = output.detach().cpu()
-            inp = input[0].detach().cpu()
+            rows = None
+            if self.sampling:
+                due, rows = self._sample(("forward", name), output.shape[0])
+                if gradients and output.requires_grad:
+                    self.pending_rows[name].append((due, rows))
+                if not due:
+                    return
 
-            if self.track_all:
-                self.activations[name].append(out)
-                self.inputs[name].append(inp)
-            else:
-                self.activations[name] = out
-                self.inputs[name] = inp
+            if activations:
+                self._store("activations", name, self._take(output, rows))
+            if inputs:
+                self._store("inputs", name, self._take(input[0], rows))
 
         return hook
 
     def _grad_hook_fn(self, name: str) -> Callable:
         def hook(module: nn.Module, grad_input, grad_output):
-            grad = grad_output[0].detach().cpu()
+            grad = grad_output[0]
+            rows = None
+            if self.sampling:
+                # backward visits repeated calls of a module in reverse order
+                pending = self.pending_rows[name]
+                if pending:
+                    due, rows = pending.pop()
+                else:
+                    due, rows = self._sample(("backward", name), grad.shape[0])
+                if not due:
+                    return
 
-            if self.track_all:
-                self.gradients[name].append(grad)
-            else:
-                self.gradients[name] = grad
+            self._store("gradients", name, self._take(grad, rows))
 
         return hook
 
     def count_module_type(self, model: nn.Module) -> Dict[str, int]:
-        type_counter = defaultdict(int)
-
-        for _, module in model.named_modules():
-            module_type = str(module).split("(")[0].strip()
-            type_counter[module_type] += 1
+        return defaultdict(int, get_model_index(model).type_counts)
 
-        return type_counter
+    def _register(self, module: nn.Module, module_name: str) -> None:
+        self.hooked_modules.append((module, module_name))
+        if self.profiler is not None:
+            self.hooks.extend(self.profiler.attach(module, module_name))
+        if self.capture & {"activations", "inputs"} or (
+            self.sampling and "gradients" in self.capture
+        ):
+            self.hooks.append(module.register_forward_hook(self._hook_fn(module_name)))
+        if "gradients" in self.capture:
+            self.hooks.append(
+                module.register_full_backward_hook(self._grad_hook_fn(module_name))
+            )
+        if "weights" in self.capture and getattr(module, "weight", None) is not None:
+            self.weight_modules[module_name] = module
 
     def register_hooks(
         self,
         model: nn.Module,
         partial_matches: List[str] = ["ALL"],
+        paths: Optional[Sequence[str]] = None,
+        module_types: Optional[Sequence[Union[type, str]]] = None,
+        pattern: Optional[Union[str, Pattern]] = None,
     ) -> None:
         """
         Module:
 
         Model class, Sequential, and every single component
         Single component will have no children.
+
+        Hooks go on leaf modules only and are named by their `Type:idx`
+        alias from the cached `ModelIndex`, counted over all leaves so names
+        do not depend on the selection and match `get_model_info`. A leaf is
+        hooked if it satisfies every selector given:
+
+        - `partial_matches`: substring of the module repr (`["ALL"]`: any),
+        - `paths`: qualified `named_modules()` name, or a parent of it,
+        - `module_types`: module class or class name,
+        - `pattern`: regex searched in the qualified name.
+
+        Each selector is prepared once, so matching is O(modules).
         """
-        type_counter = defaultdict(int)
-
-        for _, module in model.named_modules():
-            if len(list(module.children())) == 0:
-                module_type = str(module).split("(")[0].strip()
-                idx = type_counter[module_type]
-                module_name = f"{module_type}:{idx}"
-                type_counter[module_type] += 1
-
-                if partial_matches != ["ALL"]:
-                    for partial_match in partial_matches:
-                        if partial_match and partial_match in str(module):
-                            self.hooks.append(
-                                module.register_forward_hook(self._hook_fn(module_name))
-                            )
-                            self.hooks.append(
-                                module.register_full_backward_hook(
-                                    self._grad_hook_fn(module_name)
-                                )
-                            )
-                            if hasattr(module, "weight"):
-                                self.weights[module_name] = (
-                                    torch.tensor(module.weight).detach().cpu()
-                                )
-                else:
-                    self.hooks.append(
-                        module.register_forward_hook(self._hook_fn(module_name))
-                    )
-                    self.hooks.append(
-                        module.register_full_backward_hook(
-                            self._grad_hook_fn(module_name)
-                        )
-                    )
-                    if hasattr(module, "weight"):
-                        self.weights[module_name] = (
-                            torch.tensor(module.weight).detach().cpu()
-                        )
+        match_all = partial_matches == ["ALL"]
+        partial_matches = [m for m in partial_matches if m]
+        prefixes = tuple(f"{p}." for p in paths) if paths is not None else None
+        paths = set(paths) if paths is not None else None
+        type_names = {t for t in module_types or () if isinstance(t, str)}
+        type_classes = tuple(t for t in module_types or () if isinstance(t, type))
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+
+        for name, module_name, module_type, module, _ in get_model_index(model):
+            if not match_all:
+                module_repr = str(module)
+                if not any(m in module_repr for m in partial_matches):
+                    continue
+            if paths is not None and not (name in paths or name.startswith(prefixes)):
+                continue
+            if module_types is not None and not (
+                module_type in type_names or isinstance(module, type_classes)
+            ):
+                continue
+            if pattern is not None and not pattern.search(name):
+                continue
+
+            self._register(module, module_name)
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """
+        Detach the hooks for the duration of the block and reattach them on
+        exit, e.g. for extra passes under `torch.func` transforms, which full
+        backward hooks do not support and which must not be captured.
+        """
+        modules = self.hooked_modules
+        self.clear_hooks()
+        try:
+            yield
+        finally:
+            for module, module_name in modules:
+                self._register(module, module_name)
 
     def clear_hooks(self) -> None:
         for hook in self.hooks:
             hook.remove()
 
         self.hooks = []
+        self.hooked_modules = []
 
-    def get_activations(self) -> Dict:
+    def reset(self) -> None:
+        """
+        Drop captured activations, inputs and gradients but keep the hooks,
+        e.g. between mini-batches.
+        """
+        self._synchronize()
+        self.pending_rows.clear()
+        for store in (*self.captures.values(), *self.scales.values()):
+            if self.track_all:
+                for buffer in store.values():
+                    buffer.clear()
+            else:
+                store.clear()
+
+    def _views(self, store: Dict) -> Dict:
         if self.track_all:
-            return {k: torch.stack(v) for k, v in self.activations.items()}
+            return {k: v.view() for k, v in store.items() if len(v)}
 
-        return self.activations
+        return store
 
-    def get_inputs(self) -> Dict:
-        if self.track_all:
-            return {k: torch.stack(v) for k, v in self.inputs.items()}
+    def _get(self, kind: str) -> Dict:
+        """
+        With `track_all` the captures are views into the layer buffers, valid
+        until the next `reset`; copy them to keep them across batches.
+        """
+        self._synchronize()
+        captures = self._views(self.captures[kind])
+        if self.storage_dtype == "int8":
+            scales = self._views(self.scales[kind])
+            return {
+                k: dequantize_per_channel(v, scales[k]) for k, v in captures.items()
+            }
 
-        return self.inputs
+        return captures
 
-    def get_gradients(self) -> Dict:
-        if self.track_all:
-            return {k: torch.stack(v) for k, v in self.gradients.items()}
+    def get_quantized(self, kind: str) -> Dict[str, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        The raw int8 captures of `kind` with their per-call channel scales,
+        `{name: (q, scale)}`, for callers that keep them quantized.
+        """
+        if self.storage_dtype != "int8":
+            raise ValueError("HookManager was created without storage_dtype='int8'.")
 
-        return self.gradients
+        self._synchronize()
+        scales = self._views(self.scales[kind])
+        return {k: (v, scales[k]) for k, v in self._views(self.captures[kind]).items()}
+
+    def get_activations(self) -> Dict:
+        return self._get("activations")
+
+    def get_inputs(self) -> Dict:
+        return self._get("inputs")
+
+    def get_gradients(self) -> Dict:
+        return self._get("gradients")
 
     def get_weights(self) -> Dict:
+        for name, module in self.weight_modules.items():
+            if name not in self.weights:
+                self.weights[name] = module.weight.detach().to("cpu", copy=True)
+
         return self.weights
+
+    def get_profile(self) -> Dict[str, Dict[str, Any]]:
+        if self.profiler is None:
+            raise ValueError("HookManager was created without profile=True.")
+
+        return self.profiler.table()
+
+    def clear_profile(self) -> None:
+        if self.profiler is not None:
+            self.profiler.reset()
+
+    def get_stats(self) -> Dict[str, Dict[str, RunningStats]]:
+        if self.stats is None:
+            raise ValueError("HookManager was created without stats=True.")
+
+        return {kind: dict(v) for kind, v in self.stats.items()}
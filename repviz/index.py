@@ -0,0 +1,82 @@
+import weakref
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Tuple
+
+from torch import nn
+
+
+class LeafEntry(NamedTuple):
+    name: str
+    alias: str
+    module_type: str
+    module: nn.Module
+    param_shapes: Dict[str, Tuple[int, ...]]
+
+
+def _structure(model: nn.Module) -> Tuple[int, ...]:
+    """
+    Identity of every submodule and parameter: changes when one is added,
+    removed or replaced, without building reprs or walking names.
+    """
+    return (*map(id, model.modules()), *map(id, model.parameters()))
+
+
+class ModelIndex:
+    """
+    One traversal of a model's module tree, shared by `HookManager` and
+    `utils.get_model_info` so they agree on naming.
+
+    Every leaf module gets its qualified `named_modules()` name and a stable
+    `Type:idx` alias, counted per type over all leaves in definition order;
+    the alias is the key used for activations, weights and model info.
+    `type_counts` counts every module, containers included, by class name.
+    """
+
+    def __init__(self, model: nn.Module) -> None:
+        self.leaves: List[LeafEntry] = []
+        self.type_counts = defaultdict(int)
+        leaf_counts = defaultdict(int)
+
+        for name, module in model.named_modules():
+            module_type = module._get_name()
+            self.type_counts[module_type] += 1
+            if next(module.children(), None) is not None:
+                continue
+
+            alias = f"{module_type}:{leaf_counts[module_type]}"
+            leaf_counts[module_type] += 1
+            param_shapes = {
+                k: tuple(p.shape)
+                for k, p in module._parameters.items()
+                if p is not None
+            }
+            self.leaves.append(
+                LeafEntry(name, alias, module_type, module, param_shapes)
+            )
+
+        self.signature = _structure(model)
+        self.by_name = {entry.name: entry for entry in self.leaves}
+        self.by_alias = {entry.alias: entry for entry in self.leaves}
+        self.info = None
+
+    def __len__(self) -> int:
+        return len(self.leaves)
+
+    def __iter__(self):
+        return iter(self.leaves)
+
+
+_indexes = weakref.WeakKeyDictionary()
+
+
+def get_model_index(model: nn.Module, refresh: bool = False) -> ModelIndex:
+    """
+    Cached `ModelIndex` of `model`, built on first use and rebuilt whenever
+    a submodule or parameter has been added, removed or replaced since;
+    `refresh=True` forces a rebuild.
+    """
+    index = None if refresh else _indexes.get(model)
+    if index is None or index.signature != _structure(model):
+        index = _indexes[model] = ModelIndex(model)
+
+    return index
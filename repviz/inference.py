@@ -1,85 +1,483 @@
-from typing import Optional, Union, Dict, Any
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, Optional, Pattern, Sequence, Tuple, Union, Dict, Any
 
 import torch
 import numpy as np
+import torch.multiprocessing as mp
+from torch.utils.data import BatchSampler, DataLoader
 
 from .registry import Registry
+from .gradients import LossFn, per_sample_grad_norms
 from .hooks import HookManager
+from .precision import QuantizedCapture, StorageDtype
+from .store import ActivationStore
 from .utils import get_model_info
 
+STORED_KINDS = ("activations", "inputs", "gradients")
 
-def run_inference(
-    registry: Registry,
-    data: Union[np.ndarray, torch.Tensor],
-    label: Optional[np.ndarray] = None,
-    device: Union[torch.device, str] = "cpu",
-    get_gradients: bool = False,
-) -> Dict[str, Any]:
-    device = torch.device(device)
-    models = registry.get_model()
 
-    results = {}
+class BatchAccumulator:
+    """
+    Collect per-batch captures into one tensor per key along `dim`.
+
+    When the total number of samples is known up front the output is
+    preallocated after the first batch and filled in place, so no batch is
+    ever held twice; otherwise each batch is copied (the `HookManager`
+    getters return views into buffers that `reset` reuses) and the copies
+    are concatenated once at the end.
+    """
 
-    for model_name, model in models.items():
-        model.eval()
-        model_info = get_model_info(model)
-        model_hook_mgr = HookManager(track_all=True)
-        model_hook_mgr.register_hooks(model, partial_matches=["ALL"])
+    def __init__(self, n_samples: Optional[int] = None, dim: int = 1) -> None:
+        self.n_samples = n_samples
+        self.dim = dim
+        self.buffers = {}
+        self.offsets = {}
 
-        if get_gradients and label is not None:
-            if isinstance(data, np.ndarray):
-                ts_x = torch.tensor(data, dtype=torch.float32).to(device)
-                ts_y = torch.tensor(label, dtype=torch.long).to(device)
+    def update(self, captures: Dict[str, torch.Tensor]) -> None:
+        for k, v in captures.items():
+            size = v.shape[self.dim]
+            offset = self.offsets.get(k, 0)
+
+            if self.n_samples is None:
+                self.buffers.setdefault(k, []).append(v.clone())
             else:
-                ts_x = data.to(device)
-                ts_y = label.to(device)
+                if k not in self.buffers:
+                    shape = list(v.shape)
+                    shape[self.dim] = self.n_samples
+                    self.buffers[k] = torch.empty(shape, dtype=v.dtype)
+                self.buffers[k].narrow(self.dim, offset, size).copy_(v)
+
+            self.offsets[k] = offset + size
+
+    def result(self) -> Dict[str, torch.Tensor]:
+        if self.n_samples is None:
+            return {k: torch.cat(v, dim=self.dim) for k, v in self.buffers.items()}
+
+        # a partly filled buffer is copied so the unused rows can be freed
+        return {
+            k: (
+                v
+                if self.offsets[k] == v.shape[self.dim]
+                else v.narrow(self.dim, 0, self.offsets[k]).clone()
+            )
+            for k, v in self.buffers.items()
+        }
+
+
+class QuantizedAccumulator:
+    """
+    `BatchAccumulator` for `(q, scale)` int8 captures: the data stays int8
+    and the per-channel scales of every batch are kept beside it, giving
+    one `QuantizedCapture` per key.
+    """
+
+    def __init__(self, n_samples: Optional[int] = None, dim: int = 1) -> None:
+        self.data = BatchAccumulator(n_samples, dim)
+        self.dim = dim
+        self.scales = {}
+        self.rows = {}
+
+    def update(self, captures: Dict[str, Tuple[torch.Tensor, torch.Tensor]]) -> None:
+        self.data.update({k: q for k, (q, _) in captures.items()})
+        for k, (q, scale) in captures.items():
+            self.scales.setdefault(k, []).append(scale.unsqueeze(self.dim).clone())
+            self.rows.setdefault(k, []).append(q.shape[self.dim])
+
+    def result(self) -> Dict[str, QuantizedCapture]:
+        return {
+            k: QuantizedCapture(
+                v, torch.cat(self.scales[k], dim=self.dim), self.rows[k], self.dim
+            )
+            for k, v in self.data.result().items()
+        }
+
+
+class StoreAccumulator:
+    """
+    `BatchAccumulator` counterpart that streams each batch into an
+    `ActivationStore` and returns memory-mapped views as the result.
+    """
 
-            output = model(ts_x)
-            loss = torch.nn.CrossEntropyLoss()(output, ts_y)
-            loss.backward()
-            activations = {k: v for k, v in model_hook_mgr.get_activations().items()}
-            weights = {k: v for k, v in model_hook_mgr.get_weights().items()}
-            gradients = {k: v for k, v in model_hook_mgr.get_gradients().items()}
-            preds = output.detach().cpu().numpy()
+    def __init__(self, store: ActivationStore, kind: str, dim: int = 1) -> None:
+        self.store = store
+        self.kind = kind
+        self.dim = dim
 
+    def update(self, captures: Dict[str, Any]) -> None:
+        for k, v in captures.items():
+            if isinstance(v, tuple):
+                self.store.append(self.kind, k, v[0], axis=self.dim, scale=v[1])
+            else:
+                self.store.append(self.kind, k, v, axis=self.dim)
+
+    def result(self) -> Dict[str, Union[np.ndarray, QuantizedCapture]]:
+        self.store.flush()
+        return self.store.load(self.kind, dequantize=False)
+
+
+def iter_batches(
+    data: Union[np.ndarray, torch.Tensor, DataLoader],
+    label: Optional[Union[np.ndarray, torch.Tensor]] = None,
+    batch_size: Optional[int] = None,
+) -> Iterator[Tuple[torch.Tensor, Optional[torch.Tensor]]]:
+    """
+    Yield `(x, y)` batches, converting numpy slices lazily so the full
+    dataset is never materialized as a single tensor.
+    """
+    if isinstance(data, DataLoader):
+        for batch in data:
+            if isinstance(batch, (tuple, list)):
+                yield batch[0], batch[1] if len(batch) > 1 else None
+            else:
+                yield batch, None
+        return
+
+    n = len(data)
+    step = batch_size or n
+
+    for start in range(0, n, step):
+        x = data[start : start + step]
+        y = label[start : start + step] if label is not None else None
+
+        if isinstance(x, np.ndarray):
+            x = torch.as_tensor(x, dtype=torch.float32)
+        if isinstance(y, np.ndarray):
+            y = torch.as_tensor(y, dtype=torch.long)
+
+        yield x, y
+
+
+def _num_samples(data: Union[np.ndarray, torch.Tensor, DataLoader]) -> Optional[int]:
+    if isinstance(data, DataLoader):
+        # the sampler decides what is yielded; a custom batch sampler (or
+        # batch_size=None) has no known sample count
+        batches = data.batch_sampler
+        if type(batches) is not BatchSampler:
+            return None
+        try:
+            if batches.drop_last:
+                return len(batches) * batches.batch_size
+            return len(batches.sampler)
+        except TypeError:
+            return None
+
+    return len(data)
+
+
+def _captures(hook_mgr: HookManager, kind: str, quantized: bool) -> Dict[str, Any]:
+    if quantized:
+        return hook_mgr.get_quantized(kind)
+
+    return getattr(hook_mgr, f"get_{kind}")()
+
+
+def _run_model(
+    model_name: str,
+    model: torch.nn.Module,
+    data: Union[np.ndarray, torch.Tensor, DataLoader],
+    label: Optional[Union[np.ndarray, torch.Tensor]],
+    device: torch.device,
+    get_gradients: bool,
+    batch_size: Optional[int],
+    async_offload: bool,
+    stats: bool,
+    stats_options: Optional[Dict[str, Any]],
+    output_path: Optional[str],
+    paths: Optional[Sequence[str]] = None,
+    module_types: Optional[Sequence[Union[type, str]]] = None,
+    pattern: Optional[Union[str, Pattern]] = None,
+    capture: Optional[Sequence[str]] = None,
+    sampling: Optional[Dict[str, int]] = None,
+    storage_dtype: StorageDtype = None,
+    compression: Optional[str] = None,
+    profile: bool = False,
+    loss_fn: Optional[LossFn] = None,
+    per_sample_grads: bool = False,
+) -> Dict[str, Any]:
+    n_samples = _num_samples(data)
+    if capture is None:
+        capture = ["activations", "weights"]
+        if get_gradients and (label is not None or isinstance(data, DataLoader)):
+            capture.append("gradients")
+
+    model.eval()
+    model_info = get_model_info(model)
+    model_hook_mgr = HookManager(
+        track_all=True,
+        async_offload=async_offload,
+        stats=stats,
+        stats_options=stats_options,
+        capture=capture,
+        storage_dtype=storage_dtype,
+        profile=profile,
+        **(sampling or {}),
+    )
+    model_hook_mgr.register_hooks(
+        model,
+        partial_matches=["ALL"],
+        paths=paths,
+        module_types=module_types,
+        pattern=pattern,
+    )
+
+    quantized = model_hook_mgr.storage_dtype == "int8"
+    store = None
+    try:
+        if output_path is not None:
+            store = ActivationStore(
+                os.path.join(output_path, model_name), "w", compression=compression
+            )
+            store.set_meta("model_info", model_info)
+            activations = StoreAccumulator(store, "activations", dim=1)
+            inputs = StoreAccumulator(store, "inputs", dim=1)
+            gradients = StoreAccumulator(store, "gradients", dim=1)
         else:
-            with torch.no_grad():
-                if isinstance(data, np.ndarray):
-                    ts_x = torch.tensor(data, dtype=torch.float32).to(device)
-                else:
-                    ts_x = data.to(device)
+            accumulator = QuantizedAccumulator if quantized else BatchAccumulator
+            # sampled captures hold far fewer rows than the data, so they are
+            # gathered per batch instead of into a dataset-sized buffer
+            n_captured = None if model_hook_mgr.sampling else n_samples
+            activations = accumulator(n_captured, dim=1)
+            inputs = accumulator(n_captured, dim=1)
+            gradients = accumulator(n_captured, dim=1)
+        preds = BatchAccumulator(n_samples, dim=0)
+        grad_norms = BatchAccumulator(n_samples, dim=0)
+        if loss_fn is None:
+            loss_fn = torch.nn.CrossEntropyLoss()
+
+        for ts_x, ts_y in iter_batches(data, label, batch_size):
+            ts_x = ts_x.to(device)
 
+            if get_gradients and ts_y is not None:
+                ts_y = ts_y.to(device)
+                model.zero_grad(set_to_none=True)
                 output = model(ts_x)
-                activations = {
-                    k: v for k, v in model_hook_mgr.get_activations().items()
-                }
-                weights = {k: v for k, v in model_hook_mgr.get_weights().items()}
-                gradients = {k: v for k, v in model_hook_mgr.get_gradients().items()}
-                preds = output.detach().cpu().numpy()
+                loss = loss_fn(output, ts_y)
+                loss.backward()
+                gradients.update(_captures(model_hook_mgr, "gradients", quantized))
+                if per_sample_grads:
+                    with model_hook_mgr.paused():
+                        grad_norms.update(
+                            per_sample_grad_norms(model, ts_x, ts_y, loss_fn)
+                        )
+            else:
+                with torch.no_grad():
+                    output = model(ts_x)
 
-        model_hook_mgr.clear_hooks()
+            activations.update(_captures(model_hook_mgr, "activations", quantized))
+            inputs.update(_captures(model_hook_mgr, "inputs", quantized))
+            preds.update({"output": output.detach().cpu()})
+            model_hook_mgr.reset()
 
-        results[model_name] = {
+        weights = {k: v for k, v in model_hook_mgr.get_weights().items()}
+        grad_norms = grad_norms.result()
+
+        if store is not None:
+            for k, v in weights.items():
+                store.put("weights", k, v)
+            store.put("predictions", "output", preds.result()["output"])
+            for k, v in grad_norms.items():
+                store.put("per_sample_grad_norms", k, v)
+
+        result = {
             "model_info": model_info,
-            "activations": activations,
+            "activations": activations.result(),
             "weights": weights,
-            "gradients": gradients,
-            "predictions": preds,
+            "gradients": gradients.result(),
+            "predictions": preds.result()["output"].numpy(),
         }
+        if "inputs" in capture:
+            result["inputs"] = inputs.result()
+        if stats:
+            result["stats"] = model_hook_mgr.get_stats()
+        if profile:
+            result["profile"] = model_hook_mgr.get_profile()
+        if per_sample_grads:
+            result["per_sample_grad_norms"] = grad_norms
 
-    return results
+        return result
+    finally:
+        # leave the model as it was, also when a batch fails
+        model_hook_mgr.clear_hooks()
+        if get_gradients:
+            model.zero_grad(set_to_none=True)
+        if store is not None:
+            store.close()
+
+
+def _run_model_in_process(
+    model_name: str, model: torch.nn.Module, **options
+) -> Dict[str, Any]:
+    result = _run_model(model_name, model, **options)
+
+    # memmaps would be pickled by value; the parent reopens the store instead
+    if options["output_path"] is not None:
+        for kind in STORED_KINDS:
+            if kind in result:
+                result[kind] = None
 
-    # with open(os.path.join(output_path, "model_structure.json"), "w") as f:
-    #     json.dump(model_info, f)
+    return result
+
+
+def _share_memory(
+    data: Optional[Union[np.ndarray, torch.Tensor, DataLoader]],
+    dtype: torch.dtype,
+) -> Optional[Union[torch.Tensor, DataLoader]]:
+    if isinstance(data, np.ndarray):
+        data = torch.as_tensor(data, dtype=dtype)
+    if isinstance(data, torch.Tensor) and data.device.type == "cpu":
+        data = data.share_memory_()
+
+    return data
+
+
+def run_inference(
+    registry: Registry,
+    data: Union[np.ndarray, torch.Tensor, DataLoader],
+    label: Optional[np.ndarray] = None,
+    device: Union[torch.device, str] = "cpu",
+    get_gradients: bool = False,
+    batch_size: Optional[int] = None,
+    async_offload: bool = False,
+    stats: bool = False,
+    stats_options: Optional[Dict[str, Any]] = None,
+    output_path: Optional[str] = None,
+    n_workers: Optional[int] = None,
+    executor: str = "thread",
+    paths: Optional[Sequence[str]] = None,
+    module_types: Optional[Sequence[Union[type, str]]] = None,
+    pattern: Optional[Union[str, Pattern]] = None,
+    capture: Optional[Sequence[str]] = None,
+    sampling: Optional[Dict[str, int]] = None,
+    storage_dtype: StorageDtype = None,
+    compression: Optional[str] = None,
+    profile: bool = False,
+    loss_fn: Optional[LossFn] = None,
+    per_sample_grads: bool = False,
+) -> Dict[str, Any]:
+    """
+    Run every registered model over `data` and collect hook captures.
 
-    # with open(os.path.join(output_path, "activations.json"), "w") as f:
-    #     json.dump(activations, f)
+    With `batch_size` (or a `DataLoader` as `data`) the forward, and in
+    gradient mode the loss/backward, run one mini-batch at a time and the
+    captures are concatenated along the sample axis, so device memory is
+    bounded by the batch size rather than the dataset size. Captures keep
+    the `(n_calls, n_samples, ...)` layout of a single full pass.
 
-    # with open(os.path.join(output_path, "weights.json"), "w") as f:
-    #     json.dump(weights, f)
+    `async_offload` copies captures to the host off the forward path, see
+    `HookManager`.
 
-    # with open(os.path.join(output_path, "gradients.json"), "w") as f:
-    #     json.dump(gradients, f)
+    With `stats=True` only per-channel `RunningStats` are kept; they are
+    returned under `"stats"` and `"activations"`/`"gradients"` stay empty.
 
-    # with open(os.path.join(output_path, "predictions.json"), "w") as f:
-    #     json.dump(preds, f)
+    With `output_path` the captures are streamed batch by batch into an
+    `ActivationStore` at `output_path/<model_name>` and returned as
+    `np.memmap` views instead of in-memory tensors.
+
+    `n_workers > 1` runs the registered models concurrently. `executor`
+    selects either a `"thread"` pool, with torch intra-op threads split
+    evenly between workers, or a `"process"` pool (spawn) that receives the
+    input through shared memory. Results are merged into the same
+    per-model dict either way.
+
+    `paths`, `module_types` and `pattern` restrict which leaf modules are
+    hooked, see `HookManager.register_hooks`; by default every leaf is.
+
+    `capture` picks the `HookManager` capture kinds. By default only
+    activations and weights are captured, plus gradients in gradient mode,
+    so no-grad runs install no backward hooks. `"inputs"` adds an
+    `"inputs"` entry to the results.
+
+    `sampling` holds `HookManager` sampling options (`call_stride`,
+    `rows_per_call`, `max_samples`); captures then only contain the sampled
+    rows while predictions still cover every sample.
+
+    `storage_dtype` (`"float16"`, `"bfloat16"` or `"int8"`) stores captures
+    at reduced precision, see `HookManager`, and `compression` compresses
+    the `ActivationStore` files at `output_path`, see `store.get_codec`.
+    int8 captures stay quantized in the results and on disk: each is a
+    `QuantizedCapture` (int8 data plus the scales of every batch) to be
+    read with `.dequantize()`.
+
+    `profile=True` adds a `"profile"` entry: per-layer forward time, output
+    bytes and peak-allocation delta summed over all batches, keyed by the
+    same `Type:idx` names as the activations (see `LayerProfiler`).
+
+    In gradient mode every mini-batch runs its own backward of `loss_fn`
+    (`loss_fn(output, target)`, default `CrossEntropyLoss`; it must be
+    picklable for the process executor), with parameter gradients reset
+    before each batch and after the run. `per_sample_grads=True` also
+    computes the gradient of every single sample with `torch.func` and adds
+    their norms under `"per_sample_grad_norms"`, `{Type:idx.param: (n,)}`.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError("executor must be 'thread' or 'process'.")
+
+    device = torch.device(device)
+    models = registry.get_model()
+
+    options = dict(
+        data=data,
+        label=label,
+        device=device,
+        get_gradients=get_gradients,
+        batch_size=batch_size,
+        async_offload=async_offload,
+        stats=stats,
+        stats_options=stats_options,
+        output_path=output_path,
+        paths=paths,
+        module_types=module_types,
+        pattern=pattern,
+        capture=capture,
+        sampling=sampling,
+        storage_dtype=storage_dtype,
+        compression=compression,
+        profile=profile,
+        loss_fn=loss_fn,
+        per_sample_grads=per_sample_grads,
+    )
+
+    if not n_workers or n_workers <= 1 or len(models) <= 1:
+        return {
+            name: _run_model(name, model, **options) for name, model in models.items()
+        }
+
+    n_workers = min(n_workers, len(models))
+    n_threads = torch.get_num_threads()
+    threads_per_worker = max(1, n_threads // n_workers)
+
+    if executor == "thread":
+        torch.set_num_threads(threads_per_worker)
+        try:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                futures = {
+                    name: pool.submit(_run_model, name, model, **options)
+                    for name, model in models.items()
+                }
+                return {name: future.result() for name, future in futures.items()}
+        finally:
+            torch.set_num_threads(n_threads)
+
+    options["data"] = _share_memory(data, torch.float32)
+    options["label"] = _share_memory(label, torch.long)
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=mp.get_context("spawn"),
+        initializer=torch.set_num_threads,
+        initargs=(threads_per_worker,),
+    ) as pool:
+        futures = {
+            name: pool.submit(_run_model_in_process, name, model, **options)
+            for name, model in models.items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    if output_path is not None:
+        for name, result in results.items():
+            store = ActivationStore(os.path.join(output_path, name))
+            for kind in STORED_KINDS:
+                if kind in result:
+                    result[kind] = store.load(kind, dequantize=False)
+
+    return results
@@ -0,0 +1,75 @@
+from typing import Dict, List, Tuple
+
+import torch
+
+
+class Offloader:
+    """
+    Device-to-host copy engine used by the hooks so that capturing a layer
+    does not stall the forward/backward pass.
+
+    Accelerator tensors are copied into pinned host memory with
+    `non_blocking=True` on a per-device side stream; the side stream waits
+    on the compute stream so the copy sees the finished output. CPU tensors
+    are copied synchronously: there is no transfer to overlap, and a
+    deferred copy would race with later in-place ops on the same tensor.
+
+    Copies are only guaranteed to be complete after `synchronize()`. An
+    accelerator tensor modified in place before then (by the module itself
+    or a later one, e.g. `ReLU(inplace=True)`) may have been copied after
+    the change; `synchronize()` detects this from the tensor's version
+    counter and raises instead of returning wrong captures.
+    """
+
+    def __init__(self) -> None:
+        self.streams: Dict[torch.device, "torch.cuda.Stream"] = {}
+        self.events: List["torch.cuda.Event"] = []
+        self.sources: List[Tuple[torch.Tensor, int]] = []
+
+    def _stream(self, device: torch.device) -> "torch.cuda.Stream":
+        if device not in self.streams:
+            self.streams[device] = torch.cuda.Stream(device=device)
+
+        return self.streams[device]
+
+    def copy_(self, dst: torch.Tensor, src: torch.Tensor) -> torch.Tensor:
+        """
+        Schedule `dst.copy_(src)` and return `dst` immediately.
+        """
+        if not src.is_cuda:
+            return dst.copy_(src)
+
+        stream = self._stream(src.device)
+        stream.wait_stream(torch.cuda.current_stream(src.device))
+        with torch.cuda.stream(stream):
+            dst.copy_(src, non_blocking=True)
+            src.record_stream(stream)
+            event = torch.cuda.Event()
+            event.record(stream)
+        self.events.append(event)
+        self.sources.append((src, src._version))
+
+        return dst
+
+    def to_host(self, src: torch.Tensor) -> torch.Tensor:
+        """
+        Return a host tensor that will hold `src` once the copy completes.
+        """
+        if not src.is_cuda:
+            return src.clone()
+
+        dst = torch.empty(src.shape, dtype=src.dtype, pin_memory=True)
+        return self.copy_(dst, src)
+
+    def synchronize(self) -> None:
+        for event in self.events:
+            event.synchronize()
+        modified = any(src._version != version for src, version in self.sources)
+
+        self.events = []
+        self.sources = []
+        if modified:
+            raise RuntimeError(
+                "A captured tensor was modified in place before its "
+                "asynchronous copy completed; capture with async_offload=False."
+            )
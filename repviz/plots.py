@@ -1,61 +1,130 @@
-from typing import Dict, Optional, List, Union
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, List, Sequence, Tuple, Union
 
 import torch
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from .tools import cka, gram_linear
+from .attention import AttentionStats
+from .precision import QuantizedCapture
+from .stats import RunningStats
+from .tools import cka_matrix
+
+# matplotlib, seaborn and pandas are imported inside the plotting functions
+# so that importing repviz (e.g. in headless capture workers) never loads them
+
+_headless = os.environ.get("REPVIZ_HEADLESS", "") not in ("", "0")
+
+
+def set_headless(headless: bool = True) -> None:
+    """
+    In headless mode plot functions never call `plt.show()`: figures are
+    built outside pyplot (Agg canvas, nothing is registered globally), saved
+    if a `save_path` is given and returned. Also enabled by the
+    `REPVIZ_HEADLESS=1` environment variable.
+    """
+    global _headless
+    _headless = headless
+
+
+def _new_figure(figsize: Tuple[float, float], show: Optional[bool]):
+    """
+    A figure and its axes: through pyplot when the figure will be shown,
+    otherwise a standalone `Figure` that is freed with its last reference.
+    """
+    show = not _headless if show is None else show
+    if show:
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure(figsize=figsize)
+    else:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=figsize)
+
+    return fig, fig.add_subplot(), show
+
+
+def _finish(fig, save_path: Optional[str], show: bool):
+    """
+    Save and show `fig`; a shown figure is closed and not returned, so a
+    notebook does not display it a second time as the cell result.
+    """
+    fig.tight_layout()
+    if save_path is not None:
+        fig.savefig(save_path)
+    if show:
+        import matplotlib.pyplot as plt
+
+        plt.show()
+        plt.close(fig)
+        return None
+
+    return fig
+
+
+def _to_numpy(data: Union[torch.Tensor, np.ndarray, QuantizedCapture]) -> np.ndarray:
+    if isinstance(data, QuantizedCapture):
+        data = data.dequantize()
+    if isinstance(data, torch.Tensor):
+        return data.detach().cpu().numpy()
+
+    return data
+
+
+def _channel_mean(data: Union[torch.Tensor, np.ndarray, RunningStats]) -> np.ndarray:
+    if isinstance(data, RunningStats):
+        return data.mean
+    data = _to_numpy(data)
+
+    norm_axis = tuple(range(data.ndim - 1))
+    return data.mean(axis=norm_axis)
 
 
 def activation_scatter(
-    activations1: Union[torch.Tensor, np.ndarray],
-    activations2: Union[torch.Tensor, np.ndarray],
+    activations1: Union[torch.Tensor, np.ndarray, RunningStats],
+    activations2: Union[torch.Tensor, np.ndarray, RunningStats],
     layer_name: str,
-) -> None:
-    if isinstance(activations1, torch.Tensor):
-        activations1 = activations1.detach().cpu().numpy()
-    if isinstance(activations2, torch.Tensor):
-        activations2 = activations2.detach().cpu().numpy()
-
-    norm_axis = tuple(range(activations1.ndim - 1))
-    print(norm_axis)
-    activations1 = activations1.mean(axis=norm_axis)
-    activations2 = activations2.mean(axis=norm_axis)
+    save_path: Optional[str] = None,
+    show: Optional[bool] = None,
+):
+    activations1 = _channel_mean(activations1)
+    activations2 = _channel_mean(activations2)
 
     x, y = (activations1, activations2)
-    plt.figure(figsize=(8, 6))
-    plt.scatter(x, y, c=y, cmap="viridis", alpha=0.7, edgecolor="k", s=60)
+    fig, ax, show = _new_figure((8, 6), show)
+    ax.scatter(x, y, c=y, cmap="viridis", alpha=0.7, edgecolor="k", s=60)
 
     # Axis labels and title
-    plt.xlabel(f"Input to {layer_name}", fontsize=14)
-    plt.ylabel(f"Output of {layer_name}", fontsize=14)
-    plt.title(f"Layer Input vs Output ({layer_name})", fontsize=16)
+    ax.set_xlabel(f"Input to {layer_name}", fontsize=14)
+    ax.set_ylabel(f"Output of {layer_name}", fontsize=14)
+    ax.set_title(f"Layer Input vs Output ({layer_name})", fontsize=16)
 
-    plt.tight_layout()
-    plt.show()
+    return _finish(fig, save_path, show)
 
 
 def histogram(
-    data: Union[torch.Tensor, np.ndarray],
+    data: Union[torch.Tensor, np.ndarray, RunningStats],
     viz_type: str,
     layer_name: str,
     bins: int = 30,
-) -> None:
-    if isinstance(data, torch.Tensor):
-        data = data.detach().cpu().numpy()
+    save_path: Optional[str] = None,
+    show: Optional[bool] = None,
+):
+    import seaborn as sns
 
     if viz_type.lower() in ["activation", "activations"]:
-        norm_axis = tuple(range(data[0].ndim - 1))
-        data = data[0].mean(axis=norm_axis)
+        if not isinstance(data, RunningStats):
+            data = _to_numpy(data)[0]
+        data = _channel_mean(data)
     else:
-        norm_axis = tuple(range(data.ndim - 1))
-        data = data.mean(axis=norm_axis)
+        data = _channel_mean(data)
 
         if viz_type.lower() in ["gradient", "gradients"]:
             data = np.log(data)
 
+    fig, ax, show = _new_figure((6.4, 4.8), show)
     sns.histplot(
         data,
         bins=bins,
@@ -63,56 +132,81 @@ def histogram(
         color="blue",
         edgecolor="black",
         label=layer_name,
+        ax=ax,
     )
-    plt.title(f"Distribution of Mean {viz_type} for {layer_name}")
-    plt.xlabel(f"Mean {viz_type} Value")
-    plt.ylabel("Frequency")
-    plt.legend()
+    ax.set_title(f"Distribution of Mean {viz_type} for {layer_name}")
+    ax.set_xlabel(f"Mean {viz_type} Value")
+    ax.set_ylabel("Frequency")
+    ax.legend()
 
-    plt.tight_layout()
-    plt.show()
+    return _finish(fig, save_path, show)
 
 
-def plot_cka(model1_activations: Dict, model2_activations: Dict) -> None:
-    cka_matrices = np.zeros((len(model1_activations), len(model2_activations)))
+def plot_cka(
+    model1_activations: Dict,
+    model2_activations: Dict,
+    save_path: Optional[str] = None,
+    show: Optional[bool] = None,
+):
+    import seaborn as sns
 
-    for i, v1 in enumerate(model1_activations.values()):
-        for j, v2 in enumerate(model2_activations.values()):
-            norm_axis_a1 = tuple(range(v1.ndim - 2))
-            norm_axis_a2 = tuple(range(v2.ndim - 2))
-            cka_value = cka(
-                gram_linear(v1.numpy().mean(axis=norm_axis_a1)),
-                gram_linear(v2.numpy().mean(axis=norm_axis_a2)),
-            )
-            cka_matrices[len(model1_activations) - i - 1, j] = cka_value
+    cka_matrices = _to_numpy(cka_matrix(model1_activations, model2_activations))
+    cka_matrices = cka_matrices[::-1]
 
-    plt.figure(figsize=(10, 8))
+    fig, ax, show = _new_figure((10, 8), show)
     sns.heatmap(
         cka_matrices,
         annot=False,
         fmt=".2f",
         xticklabels=list(model1_activations.keys()),
         yticklabels=list(model2_activations.keys())[::-1],
+        ax=ax,
     )
-    plt.xticks(rotation=45, ha="right")
-    plt.tight_layout()
-    plt.title("CKA Matrix")
-    plt.show()
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment("right")
+    ax.set_title("CKA Matrix")
+
+    return _finish(fig, save_path, show)
+
+
+def _attention_map(
+    attn_scores: Union[torch.Tensor, np.ndarray, AttentionStats],
+) -> np.ndarray:
+    """
+    One `(T, T)` map: the mean map of an `AttentionStats`, or a captured
+    `(..., T, T)` map averaged over its leading (calls, samples, heads) axes.
+    """
+    if isinstance(attn_scores, AttentionStats):
+        attn_scores = attn_scores.mean_map
+    attn_scores = np.asarray(_to_numpy(attn_scores))
+
+    return attn_scores.reshape(-1, *attn_scores.shape[-2:]).mean(axis=0)
 
 
 def plot_query_attention_bar_seaborn(
-    attn_scores: np.ndarray,
+    attn_scores: Union[torch.Tensor, np.ndarray, AttentionStats],
     query_index: int,
     tokens=None,
     title="Query Attention",
+    save_path: Optional[str] = None,
+    show: Optional[bool] = None,
 ):
-    attn_scores = np.array(attn_scores)
+    """
+    Bar plot of the attention of query `query_index` over the other tokens,
+    in decreasing order; returns those `(token, score)` pairs and the figure
+    (`None` once shown, like the other plot functions).
+    """
+    import pandas as pd
+    import seaborn as sns
+
+    attn_scores = _attention_map(attn_scores)
     seq_len = attn_scores.shape[0]
 
-    query_attn = attn_scores[query_index]
-    indices = list(range(seq_len))
-    indices.remove(query_index)
-    values = query_attn[indices]
+    indices = np.delete(np.arange(seq_len), query_index)
+    values = attn_scores[query_index, indices]
+    order = np.argsort(-values, kind="stable")
+    indices, values = indices[order], values[order]
 
     if tokens:
         labels = [tokens[i] for i in indices]
@@ -121,36 +215,43 @@ def plot_query_attention_bar_seaborn(
         labels = [f"Token {i}" for i in indices]
         query_token = f"Token {query_index}"
 
-    sorted_pairs = sorted(zip(labels, values), key=lambda x: x[1], reverse=True)
-    print(sorted_pairs)
-    sorted_labels, sorted_values = zip(*sorted_pairs)
+    sorted_pairs = list(zip(labels, values))
 
     # Plot
-    df = pd.DataFrame({"Token": sorted_labels, "Attention Score": sorted_values})
+    df = pd.DataFrame({"Token": labels, "Attention Score": values})
 
-    plt.figure(figsize=(8, 5))
-    sns.barplot(x="Attention Score", y="Token", data=df, palette="Blues_r")
-    plt.title(f"{title} (Query: {query_token})")
-    plt.xlabel("Attention Score")
-    plt.tight_layout()
-    plt.show()
-
-    return sorted_pairs
+    fig, ax, show = _new_figure((8, 5), show)
+    sns.barplot(
+        x="Attention Score",
+        y="Token",
+        data=df,
+        hue="Token",
+        palette="Blues_r",
+        legend=False,
+        ax=ax,
+    )
+    ax.set_title(f"{title} (Query: {query_token})")
+    ax.set_xlabel("Attention Score")
+    return sorted_pairs, _finish(fig, save_path, show)
 
 
 def plot_binary_attention_seaborn(
-    attn_scores: np.ndarray,
+    attn_scores: Union[torch.Tensor, np.ndarray, AttentionStats],
     threshold: float,
     tokens: Optional[List] = None,
     title: str = "Binary Attention Map",
+    save_path: Optional[str] = None,
+    show: Optional[bool] = None,
 ):
-    attn_scores = np.array(attn_scores)
+    import seaborn as sns
+
+    attn_scores = _attention_map(attn_scores)
     binary_matrix = (attn_scores >= threshold).astype(int)
 
     if tokens is None:
         tokens = [f"Token {i}" for i in range(binary_matrix.shape[0])]
 
-    plt.figure(figsize=(8, 6))
+    fig, ax, show = _new_figure((8, 6), show)
     sns.heatmap(
         binary_matrix,
         annot=True,
@@ -161,10 +262,45 @@ def plot_binary_attention_seaborn(
         cbar=False,
         linewidths=0.5,
         linecolor="lightgrey",
+        ax=ax,
     )
-    plt.xticks(rotation=45)
-    plt.title(f"{title} (threshold = {threshold})")
-    plt.xlabel("Key")
-    plt.ylabel("Query")
-    plt.tight_layout()
-    plt.show()
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.set_title(f"{title} (threshold = {threshold})")
+    ax.set_xlabel("Key")
+    ax.set_ylabel("Query")
+
+    return _finish(fig, save_path, show)
+
+
+PlotJob = Tuple[Callable, Sequence[Any], Dict[str, Any]]
+
+
+def _render(job: PlotJob) -> str:
+    plot_fn, args, kwargs = job
+    plot_fn(*args, **dict(kwargs, show=False))
+    return kwargs["save_path"]
+
+
+def render_batch(jobs: Sequence[PlotJob], n_workers: Optional[int] = None) -> List[str]:
+    """
+    Render many figures to disk without a display, e.g. one histogram or
+    CKA heatmap per layer. Each job is `(plot_fn, args, kwargs)` with a
+    `save_path` in `kwargs`; figures are built headless and dropped as soon
+    as they are saved, so memory does not grow with the number of plots.
+
+    `n_workers > 1` fans the jobs out over a spawn process pool (`plot_fn`
+    must then be a module-level function and its arguments picklable; pass
+    channel means or `RunningStats` rather than full captures). Returns the
+    saved paths in job order.
+    """
+    for _, _, kwargs in jobs:
+        if "save_path" not in kwargs:
+            raise ValueError("Every render job needs a save_path.")
+
+    if not n_workers or n_workers <= 1 or len(jobs) <= 1:
+        return [_render(job) for job in jobs]
+
+    with ProcessPoolExecutor(
+        max_workers=min(n_workers, len(jobs)), mp_context=mp.get_context("spawn")
+    ) as pool:
+        return list(pool.map(_render, jobs, chunksize=max(1, len(jobs) // n_workers)))
@@ -0,0 +1,103 @@
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+StorageDtype = Optional[Union[torch.dtype, str]]
+
+_FLOAT_DTYPES = {
+    "float16": torch.float16,
+    "fp16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "bf16": torch.bfloat16,
+    "float32": torch.float32,
+}
+
+
+def resolve_storage_dtype(dtype: StorageDtype) -> StorageDtype:
+    """
+    Normalize a storage precision to a torch float dtype, `"int8"` or `None`
+    (keep the model precision).
+    """
+    if dtype is None or isinstance(dtype, torch.dtype) or dtype == "int8":
+        return dtype
+    if dtype in _FLOAT_DTYPES:
+        return _FLOAT_DTYPES[dtype]
+
+    raise ValueError(f"Unsupported storage dtype: {dtype}.")
+
+
+def quantize_per_channel(x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Symmetric int8 quantization with one float32 scale per channel (last
+    axis).
+    """
+    x = x.detach()
+    amax = x.abs().reshape(-1, x.shape[-1]).amax(dim=0).to(torch.float32)
+    scale = (amax / 127).clamp_min(torch.finfo(torch.float32).tiny)
+    q = torch.round(x / scale).clamp_(-127, 127).to(torch.int8)
+    return q, scale
+
+
+def dequantize_per_channel(
+    q: torch.Tensor, scale: torch.Tensor, dtype: torch.dtype = torch.float32
+) -> torch.Tensor:
+    """
+    Inverse of `quantize_per_channel`; `q` and `scale` may carry leading
+    axes (calls, as returned by `CaptureBuffer.view`, then samples), the
+    axes between them and the channel axis are broadcast.
+    """
+    shape = (*scale.shape[:-1], *[1] * (q.ndim - scale.ndim), scale.shape[-1])
+    return q.to(dtype) * scale.reshape(shape).to(dtype)
+
+
+class QuantizedCapture:
+    """
+    int8 captures of several batches concatenated along `dim`. Every batch
+    keeps its own per-channel scales: `scales` has the batch index in place
+    of the sample axis (`(n_calls, n_batches, C)` for captures) and `rows`
+    the number of samples of each batch.
+
+    Deliberately not a tuple and not indexable, so the raw codes are never
+    mistaken for values; read them with `dequantize()`, as plots and CKA do.
+    """
+
+    __slots__ = ("data", "scales", "rows", "dim")
+
+    def __init__(
+        self,
+        data: Union[torch.Tensor, np.ndarray],
+        scales: Union[torch.Tensor, np.ndarray],
+        rows: Sequence[int],
+        dim: int = 1,
+    ) -> None:
+        self.data = data
+        self.scales = scales
+        self.rows = rows
+        self.dim = dim
+
+    def __repr__(self) -> str:
+        return f"QuantizedCapture(shape={self.shape}, batches={len(self.rows)})"
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.asarray(self.data).nbytes + np.asarray(self.scales).nbytes)
+
+    def dequantize(self, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        batch = torch.repeat_interleave(
+            torch.arange(len(self.rows)), torch.as_tensor(self.rows)
+        )
+        scales = _as_tensor(self.scales).index_select(self.dim, batch)
+        return dequantize_per_channel(_as_tensor(self.data), scales, dtype)
+
+
+def _as_tensor(data: Union[torch.Tensor, np.ndarray]) -> torch.Tensor:
+    # store reads are read-only memmaps, which torch does not wrap
+    if isinstance(data, torch.Tensor):
+        return data
+
+    return torch.from_numpy(np.array(data))
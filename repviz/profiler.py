@@ -0,0 +1,118 @@
+import time
+from typing import Any, Dict, Optional
+
+import torch
+from torch import nn
+
+
+def _first_tensor(values: Any) -> Optional[torch.Tensor]:
+    if isinstance(values, torch.Tensor):
+        return values
+    if isinstance(values, (tuple, list)):
+        for value in values:
+            tensor = _first_tensor(value)
+            if tensor is not None:
+                return tensor
+
+    return None
+
+
+def _nbytes(values: Any) -> int:
+    if isinstance(values, torch.Tensor):
+        return values.numel() * values.element_size()
+    if isinstance(values, (tuple, list)):
+        return sum(_nbytes(value) for value in values)
+    if isinstance(values, dict):
+        return sum(_nbytes(value) for value in values.values())
+
+    return 0
+
+
+class LayerProfiler:
+    """
+    Per-module forward cost, recorded by a pre/post forward hook pair:
+
+    - wall time of each call; on CUDA the device is synchronized before and
+      after the module so the time covers its kernels and nothing else,
+    - bytes of the module output,
+    - on CUDA, the peak allocation above the allocation at the pre-hook,
+      i.e. the transient memory the module needed.
+
+    Calls accumulate until `reset`; `table` aggregates them per module name.
+    """
+
+    def __init__(self) -> None:
+        self.records = {}
+        self._start = {}
+
+    def _record(self, name: str) -> Dict[str, Any]:
+        if name not in self.records:
+            self.records[name] = {
+                "calls": 0,
+                "total_time": 0.0,
+                "min_time": float("inf"),
+                "max_time": 0.0,
+                "output_bytes": 0,
+                "peak_bytes": 0,
+            }
+
+        return self.records[name]
+
+    def pre_hook(self, name: str):
+        def hook(module: nn.Module, inputs) -> None:
+            tensor = _first_tensor(inputs)
+            device = tensor.device if tensor is not None else None
+            allocated = None
+            if device is not None and device.type == "cuda":
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+                allocated = torch.cuda.memory_allocated(device)
+
+            self._start[name] = (device, allocated, time.perf_counter())
+
+        return hook
+
+    def post_hook(self, name: str):
+        def hook(module: nn.Module, inputs, output) -> None:
+            device, allocated, start = self._start.pop(name)
+            if allocated is not None:
+                torch.cuda.synchronize(device)
+            elapsed = time.perf_counter() - start
+
+            record = self._record(name)
+            record["calls"] += 1
+            record["total_time"] += elapsed
+            record["min_time"] = min(record["min_time"], elapsed)
+            record["max_time"] = max(record["max_time"], elapsed)
+            record["output_bytes"] += _nbytes(output)
+            if allocated is not None:
+                peak = torch.cuda.max_memory_allocated(device) - allocated
+                record["peak_bytes"] = max(record["peak_bytes"], peak)
+
+        return hook
+
+    def attach(self, module: nn.Module, name: str) -> list:
+        """
+        Install the hook pair on `module`; returns the handles. The post
+        hook is registered before any capture hook so capture cost is not
+        attributed to the module.
+        """
+        return [
+            module.register_forward_pre_hook(self.pre_hook(name)),
+            module.register_forward_hook(self.post_hook(name)),
+        ]
+
+    def table(self) -> Dict[str, Dict[str, Any]]:
+        """
+        One row per module in first-call order: `calls`, `total_time`,
+        `mean_time`, `min_time`, `max_time` (seconds), `output_bytes`
+        (summed over calls) and `peak_bytes` (max over calls, CUDA only).
+        """
+        return {
+            name: dict(record, mean_time=record["total_time"] / record["calls"])
+            for name, record in self.records.items()
+        }
+
+    def reset(self) -> None:
+        self.records = {}
+        self._start = {}
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from typing import Any, Iterator, Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+from .cache import fingerprint
+
+Matrix = Union[torch.Tensor, np.ndarray, Sequence[np.ndarray]]
+
+MAX_CACHED_PROJECTORS = 16
+_projectors = OrderedDict()
+
+
+def _to_numpy(mat: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
+    if isinstance(mat, torch.Tensor):
+        # shares memory with CPU tensors instead of copying like np.array()
+        return mat.detach().cpu().numpy()
+
+    return mat
+
+
+def _iter_chunks(mat: Matrix, batch_size: int) -> Iterator[np.ndarray]:
+    """
+    Yield row chunks of `mat`; a list of batches is yielded as is, and a
+    memmap is only paged in one chunk at a time.
+    """
+    if isinstance(mat, (list, tuple)):
+        for batch in mat:
+            yield np.asarray(_to_numpy(batch))
+        return
+
+    mat = _to_numpy(mat)
+    for start in range(0, mat.shape[0], batch_size):
+        yield np.asarray(mat[start : start + batch_size])
+
+
+def _concat(mat: Matrix) -> np.ndarray:
+    if isinstance(mat, (list, tuple)):
+        return np.concatenate([_to_numpy(batch) for batch in mat])
+
+    return np.asarray(_to_numpy(mat))
+
+
+def _num_rows(mat: Matrix) -> int:
+    if isinstance(mat, (list, tuple)):
+        return sum(len(batch) for batch in mat)
+
+    return mat.shape[0]
+
+
+class Projector:
+    """
+    A fitted projection to `n_components` dimensions whose `transform` runs
+    chunk by chunk, so the same basis can be reused across plots.
+    """
+
+    def __init__(self, estimator: Any, batch_size: int = 65536) -> None:
+        self.estimator = estimator
+        self.batch_size = batch_size
+
+    def _transform_chunk(self, chunk: np.ndarray) -> np.ndarray:
+        return self.estimator.transform(chunk)
+
+    def transform(self, mat: Matrix) -> np.ndarray:
+        return np.concatenate(
+            [self._transform_chunk(c) for c in _iter_chunks(mat, self.batch_size)]
+        )
+
+
+class LandmarkTSNE(Projector):
+    """
+    Barnes-Hut t-SNE fitted on a random subsample of landmark rows; every
+    other row is placed at the distance-weighted mean of the embeddings of
+    its `n_neighbors` nearest landmarks.
+    """
+
+    def __init__(
+        self,
+        landmarks: np.ndarray,
+        embedding: np.ndarray,
+        n_neighbors: int = 10,
+        batch_size: int = 65536,
+    ) -> None:
+        from sklearn.neighbors import NearestNeighbors
+
+        super().__init__(None, batch_size)
+        self.embedding = embedding
+        self.n_neighbors = min(n_neighbors, len(landmarks))
+        self.neighbors = NearestNeighbors(n_neighbors=self.n_neighbors)
+        self.neighbors.fit(landmarks)
+
+    def _transform_chunk(self, chunk: np.ndarray) -> np.ndarray:
+        distances, indices = self.neighbors.kneighbors(chunk)
+        weights = 1.0 / (distances + 1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum("nk,nkc->nc", weights, self.embedding[indices])
+
+
+def _cache_key(mat: Matrix, *options) -> str:
+    if isinstance(mat, (list, tuple)):
+        digest = "".join(fingerprint(batch) for batch in mat)
+    else:
+        digest = fingerprint(mat)
+
+    return f"{digest}-{options}"
+
+
+def fit_projector(
+    mat: Matrix,
+    n_components: int,
+    method: str = "PCA",
+    batch_size: int = 65536,
+    max_samples: int = 10000,
+    random_state: Optional[int] = 0,
+    cache: bool = True,
+    **kwargs,
+) -> Projector:
+    """
+    Fit a projection of the rows of `mat`, which may be an array, a tensor,
+    a memmap from `ActivationStore` or a list of row batches.
+
+    - `"PCA"`: randomized SVD once the matrix is larger than `max_samples`
+      rows (exact otherwise, unless `svd_solver` is given).
+    - `"IncrementalPCA"`: `partial_fit` over chunks of `batch_size` rows, so
+      the full matrix is never loaded at once.
+    - `"TSNE"`: Barnes-Hut t-SNE on at most `max_samples` landmark rows,
+      see `LandmarkTSNE`.
+
+    Fitted projectors are kept in a small LRU cache keyed by the content of
+    `mat` and the options, so repeated plots reuse the same basis.
+
+    scikit-learn is only imported here, on the first fit.
+    """
+    if cache:
+        # fingerprinting reads all of `mat`, so it is skipped without a cache
+        key = _cache_key(mat, n_components, method, max_samples, random_state, kwargs)
+        if key in _projectors:
+            _projectors.move_to_end(key)
+            return _projectors[key]
+
+    from sklearn.decomposition import PCA, IncrementalPCA
+    from sklearn.manifold import TSNE
+
+    if method == "PCA":
+        n_rows = _num_rows(mat)
+        kwargs.setdefault(
+            "svd_solver", "randomized" if n_rows > max_samples else "auto"
+        )
+        estimator = PCA(n_components=n_components, random_state=random_state, **kwargs)
+        projector = Projector(estimator.fit(_concat(mat)), batch_size)
+    elif method == "IncrementalPCA":
+        estimator = IncrementalPCA(n_components=n_components, **kwargs)
+        for chunk in _iter_chunks(mat, batch_size):
+            estimator.partial_fit(chunk)
+        projector = Projector(estimator, batch_size)
+    elif method == "TSNE":
+        n_rows = _num_rows(mat)
+        if n_rows > max_samples:
+            rng = np.random.default_rng(random_state)
+            idx = np.sort(rng.choice(n_rows, max_samples, replace=False))
+            if isinstance(mat, (list, tuple)):
+                data = _concat(mat)[idx]
+            else:
+                # only the landmark rows of a memmap are read
+                data = np.asarray(_to_numpy(mat)[idx])
+        else:
+            data = _concat(mat)
+        tsne = TSNE(
+            n_components=n_components,
+            method="barnes_hut" if n_components < 4 else "exact",
+            random_state=random_state,
+            **kwargs,
+        )
+        projector = LandmarkTSNE(data, tsne.fit_transform(data), batch_size=batch_size)
+    else:
+        raise ValueError("method must be 'PCA', 'IncrementalPCA' or 'TSNE'.")
+
+    if cache:
+        _projectors[key] = projector
+        while len(_projectors) > MAX_CACHED_PROJECTORS:
+            _projectors.popitem(last=False)
+
+    return projector
+
+
+def clear_projector_cache() -> None:
+    _projectors.clear()
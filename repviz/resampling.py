@@ -0,0 +1,354 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+from .tools import _as_2d, _debiased_dot_product_similarity_helper, gram_linear
+
+Activations = Union[Dict, Sequence]
+
+
+def _center_grams(grams: torch.Tensor, unbiased: bool) -> torch.Tensor:
+    """
+    `tools.center_gram` over a batch of Gram matrices `(B, n, n)`.
+    """
+    n = grams.shape[-1]
+    if not unbiased:
+        means = grams.mean(1)
+        means = means - means.mean(1, keepdim=True) / 2
+        return grams - means[:, :, None] - means[:, None, :]
+
+    off_diagonal = 1 - torch.eye(n, dtype=grams.dtype, device=grams.device)
+    grams = grams * off_diagonal
+    means = grams.sum(1) / (n - 2)
+    means = means - means.sum(1, keepdim=True) / (2 * (n - 1))
+    return (grams - means[:, :, None] - means[:, None, :]) * off_diagonal
+
+
+def _gram_space(
+    grams: List[torch.Tensor], idx: Optional[torch.Tensor], debiased: bool
+) -> torch.Tensor:
+    """
+    `(layers, B, n * n)` normalized centered Grams of the samples `idx`
+    (`(B, n)`, or `None` for the original order, B = 1) of every layer.
+    """
+    out = []
+    for gram in grams:
+        if idx is None:
+            resampled = gram[None]
+        else:
+            resampled = gram[idx[:, :, None], idx[:, None, :]]
+        flat = _center_grams(resampled, debiased).flatten(1)
+        out.append(flat / torch.linalg.norm(flat, dim=1, keepdim=True))
+
+    return torch.stack(out)
+
+
+def _feature_space(
+    features: List[torch.Tensor], idx: Optional[torch.Tensor], debiased: bool
+) -> List[tuple]:
+    """
+    Per layer: centered resampled features `(B, n, d)`, per-sample squared
+    norms `(B, n)` and the (debiased) norm of `X^T X` `(B,)`.
+    """
+    out = []
+    for x in features:
+        x = x[None] if idx is None else x[idx]
+        x = x - x.mean(1, keepdim=True)
+        rows = (x * x).sum(-1)
+        norm = torch.linalg.matrix_norm(x.transpose(1, 2) @ x)
+        if debiased:
+            total = rows.sum(-1)
+            norm = torch.sqrt(
+                _debiased_dot_product_similarity_helper(
+                    norm**2, (rows * rows).sum(-1), total, total, x.shape[1]
+                )
+            )
+        out.append((x, rows, norm))
+
+    return out
+
+
+def _feature_cka(xs: List[tuple], ys: List[tuple], debiased: bool) -> torch.Tensor:
+    values = []
+    for x, a, norm_x in xs:
+        row = []
+        for y, b, norm_y in ys:
+            dot = ((x.transpose(1, 2) @ y) ** 2).sum((1, 2))
+            if debiased:
+                dot = _debiased_dot_product_similarity_helper(
+                    dot, (a * b).sum(-1), a.sum(-1), b.sum(-1), x.shape[1]
+                )
+            row.append(dot / (norm_x * norm_y))
+        values.append(torch.stack(row, -1))
+
+    return torch.stack(values, -2)
+
+
+def _cka_replicates(
+    data1: List[torch.Tensor],
+    data2: List[torch.Tensor],
+    idx1: Optional[torch.Tensor],
+    idx2: Optional[torch.Tensor],
+    space: str,
+    debiased: bool,
+) -> torch.Tensor:
+    """
+    `(B, layers1, layers2)` CKA with the samples of model 1 / model 2 taken
+    at `idx1` / `idx2`.
+    """
+    if space == "feature":
+        return _feature_cka(
+            _feature_space(data1, idx1, debiased),
+            _feature_space(data2, idx2, debiased),
+            debiased,
+        )
+
+    grams1 = _gram_space(data1, idx1, debiased)
+    grams2 = _gram_space(data2, idx2, debiased)
+    if idx1 is None:
+        return torch.einsum("in,jbn->bij", grams1[:, 0], grams2)
+
+    return torch.einsum("ibn,jbn->bij", grams1, grams2)
+
+
+def _run_replicates(
+    data1: List[torch.Tensor],
+    data2: List[torch.Tensor],
+    kind: str,
+    n_resamples: int,
+    seed: int,
+    space: str,
+    debiased: bool,
+    chunk_size: int,
+) -> np.ndarray:
+    n = data1[0].shape[0]
+    device = data1[0].device
+    generator = torch.Generator().manual_seed(seed)
+
+    chunks = []
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        if kind == "bootstrap":
+            idx = torch.randint(n, (size, n), generator=generator).to(device)
+            chunks.append(_cka_replicates(data1, data2, idx, idx, space, debiased))
+        else:
+            perm = torch.argsort(torch.rand(size, n, generator=generator), dim=1)
+            chunks.append(
+                _cka_replicates(data1, data2, None, perm.to(device), space, debiased)
+            )
+
+    return torch.cat(chunks).cpu().numpy()
+
+
+def _prepare(
+    activations: Activations, device: Optional[Union[torch.device, str]]
+) -> List[torch.Tensor]:
+    if isinstance(activations, dict):
+        activations = list(activations.values())
+
+    out = []
+    for x in activations:
+        x = _as_2d(x)
+        if not isinstance(x, torch.Tensor):
+            x = torch.as_tensor(np.asarray(x))
+        out.append(x.to(device=device, dtype=torch.float64))
+
+    return out
+
+
+def _seed_sequences(
+    seed: Optional[int], n_workers: Optional[int]
+) -> List[np.random.SeedSequence]:
+    if not n_workers or n_workers <= 1:
+        return [np.random.SeedSequence(seed)]
+
+    return np.random.SeedSequence(seed).spawn(n_workers)
+
+
+def _resample(
+    activations1: Activations,
+    activations2: Activations,
+    kind: str,
+    n_resamples: int,
+    debiased: bool,
+    space: str,
+    chunk_size: Optional[int],
+    max_bytes: int,
+    seed: Optional[int],
+    n_workers: Optional[int],
+    device: Optional[Union[torch.device, str]],
+) -> tuple:
+    data1 = _prepare(activations1, device)
+    data2 = _prepare(activations2, device)
+    shapes = [x.shape for x in data1 + data2]
+    n = shapes[0][0]
+    if any(shape[0] != n for shape in shapes):
+        raise ValueError("All activations must have the same number of samples.")
+
+    if space == "auto":
+        space = "feature" if max(shape[1] for shape in shapes) < n else "gram"
+    if space not in ("gram", "feature"):
+        raise ValueError("space must be 'auto', 'gram' or 'feature'.")
+
+    if chunk_size is None:
+        if space == "gram":
+            per_replicate = 3 * len(shapes) * n * n * 8
+        else:
+            per_replicate = 2 * sum(shape[1] for shape in shapes) * n * 8
+        chunk_size = int(max(1, min(n_resamples, max_bytes // per_replicate)))
+
+    if space == "gram":
+        data1 = [gram_linear(x) for x in data1]
+        data2 = [gram_linear(x) for x in data2]
+    observed = _cka_replicates(data1, data2, None, None, space, debiased)[0]
+
+    # one independent torch seed per worker
+    seeds = [int(s.generate_state(1)[0]) for s in _seed_sequences(seed, n_workers)]
+    if len(seeds) == 1:
+        replicates = _run_replicates(
+            data1, data2, kind, n_resamples, seeds[0], space, debiased, chunk_size
+        )
+    else:
+        sizes = np.diff(np.linspace(0, n_resamples, n_workers + 1).astype(int))
+        data1 = [x.cpu() for x in data1]
+        data2 = [x.cpu() for x in data2]
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=mp.get_context("spawn")
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _run_replicates,
+                    data1,
+                    data2,
+                    kind,
+                    int(size),
+                    s,
+                    space,
+                    debiased,
+                    chunk_size,
+                )
+                for size, s in zip(sizes, seeds)
+                if size
+            ]
+            replicates = np.concatenate([f.result() for f in futures])
+
+    return observed.cpu().numpy(), replicates
+
+
+def bootstrap_cka_matrix(
+    activations1: Activations,
+    activations2: Activations,
+    n_boot: int = 1000,
+    confidence: float = 0.95,
+    debiased: bool = False,
+    space: str = "auto",
+    chunk_size: Optional[int] = None,
+    max_bytes: int = 2**28,
+    seed: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    device: Optional[Union[torch.device, str]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Paired bootstrap of `tools.cka_matrix`: every replicate resamples the
+    probe samples with replacement, the same indices for all layers of both
+    models, and recomputes the linear CKA of every layer pair.
+
+    Nothing is recomputed from the activations: in `"gram"` space each
+    layer's Gram matrix is built once and replicates index into it, in
+    `"feature"` space (cheaper when layers are narrower than the number of
+    samples; `"auto"` picks it then) the features are indexed instead. A
+    chunk of replicates is one batched tensor operation, with the chunk
+    size derived from `max_bytes` unless given. `n_workers > 1` splits the
+    replicates over a spawn process pool, each worker with its own seed
+    derived from `seed`.
+
+    Returns the observed matrix (`"value"`), the percentile interval
+    (`"low"`, `"high"`), the bootstrap standard error (`"std"`) and all
+    `"replicates"`, `(n_boot, layers1, layers2)`.
+    """
+    observed, replicates = _resample(
+        activations1,
+        activations2,
+        "bootstrap",
+        n_boot,
+        debiased,
+        space,
+        chunk_size,
+        max_bytes,
+        seed,
+        n_workers,
+        device,
+    )
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(replicates, [alpha, 1 - alpha], axis=0)
+
+    return {
+        "value": observed,
+        "low": low,
+        "high": high,
+        "std": replicates.std(axis=0, ddof=1),
+        "replicates": replicates,
+    }
+
+
+def permutation_test_cka_matrix(
+    activations1: Activations,
+    activations2: Activations,
+    n_perm: int = 1000,
+    debiased: bool = False,
+    space: str = "auto",
+    chunk_size: Optional[int] = None,
+    max_bytes: int = 2**28,
+    seed: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    device: Optional[Union[torch.device, str]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Permutation test of `tools.cka_matrix` against independence: the null
+    distribution shuffles the samples of model 2 relative to model 1, one
+    permutation shared by all its layers. Resampling works as in
+    `bootstrap_cka_matrix`.
+
+    Returns the observed matrix (`"value"`), the one-sided `"p_value"`
+    `(1 + #{null >= value}) / (1 + n_perm)` and the `"null"` replicates.
+    """
+    observed, null = _resample(
+        activations1,
+        activations2,
+        "permutation",
+        n_perm,
+        debiased,
+        space,
+        chunk_size,
+        max_bytes,
+        seed,
+        n_workers,
+        device,
+    )
+    p_value = (1 + (null >= observed).sum(axis=0)) / (1 + len(null))
+
+    return {"value": observed, "p_value": p_value, "null": null}
+
+
+def bootstrap_cka(
+    x: Union[torch.Tensor, np.ndarray], y: Union[torch.Tensor, np.ndarray], **kwargs
+) -> Dict[str, Any]:
+    """
+    `bootstrap_cka_matrix` for a single pair of activations; the returned
+    values are scalars and `"replicates"` is `(n_boot,)`.
+    """
+    result = bootstrap_cka_matrix([x], [y], **kwargs)
+    return {k: v[..., 0, 0] for k, v in result.items()}
+
+
+def permutation_test_cka(
+    x: Union[torch.Tensor, np.ndarray], y: Union[torch.Tensor, np.ndarray], **kwargs
+) -> Dict[str, Any]:
+    """
+    `permutation_test_cka_matrix` for a single pair of activations.
+    """
+    result = permutation_test_cka_matrix([x], [y], **kwargs)
+    return {k: v[..., 0, 0] for k, v in result.items()}
@@ -0,0 +1,134 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class RunningStats:
+    """
+    Streaming per-channel summary of a captured tensor.
+
+    Every `update` flattens all leading axes into samples and treats the last
+    axis as channels, the same reduction `repviz.plots` applies to full
+    captures. Memory is O(channels) no matter how many samples are seen:
+
+    - mean / variance via Welford updates merged batch-wise (Chan et al.),
+    - running min / max,
+    - a fixed-bin histogram per channel; the bin range is `hist_range` or,
+      if not given, the min/max of the first batch, with out-of-range
+      values counted in the edge bins,
+    - optionally a row reservoir of `quantile_samples` rows used as a
+      quantile sketch.
+    """
+
+    def __init__(
+        self,
+        bins: int = 30,
+        hist_range: Optional[Tuple[float, float]] = None,
+        quantile_samples: int = 0,
+    ) -> None:
+        self.bins = bins
+        self.hist_range = hist_range
+        self.quantile_samples = quantile_samples
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+        self._min = None
+        self._max = None
+        self._hist = None
+        self._reservoir = None
+
+    @torch.no_grad()
+    def update(self, x: torch.Tensor) -> None:
+        x = x.detach().reshape(-1, x.shape[-1]).to(torch.float64)
+        n = x.shape[0]
+        if n == 0:
+            return
+
+        batch_mean = x.mean(dim=0)
+        batch_m2 = ((x - batch_mean) ** 2).sum(dim=0)
+        batch_min = x.min(dim=0).values
+        batch_max = x.max(dim=0).values
+
+        if self.count == 0:
+            self._mean = batch_mean.cpu()
+            self._m2 = batch_m2.cpu()
+            self._min = batch_min.cpu()
+            self._max = batch_max.cpu()
+            if self.hist_range is None:
+                self.hist_range = (batch_min.min().item(), batch_max.max().item())
+            self._hist = torch.zeros((x.shape[1], self.bins), dtype=torch.int64)
+        else:
+            total = self.count + n
+            delta = batch_mean.cpu() - self._mean
+            self._mean += delta * n / total
+            self._m2 += batch_m2.cpu() + delta**2 * self.count * n / total
+            self._min = torch.minimum(self._min, batch_min.cpu())
+            self._max = torch.maximum(self._max, batch_max.cpu())
+
+        self._update_histogram(x)
+        if self.quantile_samples:
+            self._update_reservoir(x)
+        self.count += n
+
+    def _update_histogram(self, x: torch.Tensor) -> None:
+        low, high = self.hist_range
+        width = (high - low) / self.bins or 1.0
+        idx = ((x - low) / width).floor().clamp_(0, self.bins - 1).long()
+        idx += torch.arange(x.shape[1], device=x.device) * self.bins
+        counts = torch.bincount(idx.ravel(), minlength=x.shape[1] * self.bins)
+        self._hist += counts.view(x.shape[1], self.bins).cpu()
+
+    def _update_reservoir(self, x: torch.Tensor) -> None:
+        x = x.cpu()
+        k = self.quantile_samples
+
+        if self._reservoir is None:
+            self._reservoir = x.new_empty((0, x.shape[1]))
+        fill = min(k - self._reservoir.shape[0], x.shape[0])
+        if fill > 0:
+            self._reservoir = torch.cat([self._reservoir, x[:fill]])
+            x = x[fill:]
+        if not x.shape[0]:
+            return
+
+        # Algorithm R, vectorized: row i replaces a random slot with p = k / (i+1)
+        seen = self.count + max(fill, 0)
+        positions = torch.arange(seen, seen + x.shape[0], dtype=torch.float64)
+        slots = (torch.rand(x.shape[0], dtype=torch.float64) * (positions + 1)).long()
+        accepted = slots < k
+        self._reservoir[slots[accepted]] = x[accepted]
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self._mean.numpy()
+
+    @property
+    def var(self) -> np.ndarray:
+        return (self._m2 / max(self.count - 1, 1)).numpy()
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    @property
+    def min(self) -> np.ndarray:
+        return self._min.numpy()
+
+    @property
+    def max(self) -> np.ndarray:
+        return self._max.numpy()
+
+    def histogram(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per-channel bin counts of shape `(channels, bins)` and the shared
+        bin edges.
+        """
+        edges = np.linspace(*self.hist_range, self.bins + 1)
+        return self._hist.numpy(), edges
+
+    def quantile(self, q: float) -> np.ndarray:
+        if self._reservoir is None:
+            raise ValueError("Quantiles require quantile_samples > 0.")
+
+        return np.quantile(self._reservoir.numpy(), q, axis=0)
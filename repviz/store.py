@@ -0,0 +1,304 @@
+import os
+import bz2
+import json
+import lzma
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .precision import QuantizedCapture, dequantize_per_channel
+
+
+def get_codec(name: str) -> Tuple[str, Callable, Callable]:
+    """
+    `(name, compress, decompress)` for a compression codec. `zstd` and `lz4`
+    need the optional `zstandard` / `lz4` packages and fall back to `zlib`
+    when they are not installed; the name returned is the codec actually
+    used.
+    """
+    if name == "zstd":
+        try:
+            import zstandard
+
+            return (
+                name,
+                zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress,
+            )
+        except ImportError:
+            name = "zlib"
+    if name == "lz4":
+        try:
+            import lz4.frame
+
+            return name, lz4.frame.compress, lz4.frame.decompress
+        except ImportError:
+            name = "zlib"
+
+    codecs = {
+        "zlib": (zlib.compress, zlib.decompress),
+        "lzma": (lzma.compress, lzma.decompress),
+        "bz2": (bz2.compress, bz2.decompress),
+    }
+    if name not in codecs:
+        raise ValueError(f"Unknown compression codec: {name}.")
+
+    return (name, *codecs[name])
+
+
+class ActivationStore:
+    """
+    Binary on-disk store for the captures of one model.
+
+    Layout of `root`:
+
+        manifest.json           {kind: {name: {file, dtype, shape, axis, offset}}}
+        <kind>/<name>.bin       raw C-order data
+
+    Each entry is written with its streaming axis (`axis`, the sample axis
+    for captures) moved to the front, so new batches are plain appends to
+    the end of the file. `shape` in the manifest is the logical shape; reads
+    go through `np.memmap` and move the axis back, so a layer or a slice of
+    samples is only paged in when it is actually used.
+
+    With `compression` (see `get_codec`) every append is written as one
+    compressed chunk, listed in the entry's `chunks` as `[offset, nbytes,
+    rows]`; reads then decompress only the chunks a slice touches instead
+    of memory-mapping. bfloat16 tensors, which NumPy cannot represent, are
+    stored as their raw 16-bit patterns and read back as float32.
+
+    int8 captures appended with their per-channel `scale` keep the scales of
+    every append under `<kind>_scales/<name>` and the rows of each append in
+    the entry's `scale_rows`; reads dequantize to float32 unless asked for
+    the raw `QuantizedCapture`.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(
+        self, root: str, mode: str = "r", compression: Optional[str] = None
+    ) -> None:
+        if mode not in ("r", "w"):
+            raise ValueError("mode must be 'r' or 'w'.")
+
+        self.root = root
+        self.mode = mode
+        self.files = {}
+        self.codec = get_codec(compression) if compression else None
+
+        if mode == "w":
+            os.makedirs(root, exist_ok=True)
+            self.manifest = {}
+        else:
+            with open(os.path.join(root, self.MANIFEST)) as f:
+                self.manifest = json.load(f)
+
+    def __enter__(self) -> "ActivationStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _path(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(self.root, entry["file"])
+
+    def append(
+        self,
+        kind: str,
+        name: str,
+        data: Union[torch.Tensor, np.ndarray],
+        axis: int = 0,
+        scale: Optional[torch.Tensor] = None,
+    ) -> None:
+        """
+        Append `data` to entry `kind/name` along `axis`; `scale` holds the
+        per-channel scales of int8 `data` (its shape without `axis`).
+        """
+        torch_dtype = None
+        if isinstance(data, torch.Tensor):
+            data = data.detach().cpu()
+            if data.dtype == torch.bfloat16:
+                torch_dtype = "bfloat16"
+                data = data.view(torch.int16)
+            data = data.numpy()
+        axis = axis % data.ndim
+
+        entries = self.manifest.setdefault(kind, {})
+        if name not in entries:
+            filename = os.path.join(kind, f"{name.replace(os.sep, '_')}.bin")
+            os.makedirs(os.path.join(self.root, kind), exist_ok=True)
+            entries[name] = {
+                "file": filename,
+                "dtype": data.dtype.str,
+                "shape": [0 if i == axis else s for i, s in enumerate(data.shape)],
+                "axis": axis,
+                "offset": 0,
+            }
+            if torch_dtype is not None:
+                entries[name]["torch_dtype"] = torch_dtype
+            if scale is not None:
+                entries[name]["scale_rows"] = []
+            if self.codec is not None:
+                entries[name]["compression"] = self.codec[0]
+                entries[name]["chunks"] = []
+            self.files[(kind, name)] = open(os.path.join(self.root, filename), "wb")
+
+        entry = entries[name]
+        if data.dtype.str != entry["dtype"]:
+            raise ValueError(f"{kind}/{name}: dtype {data.dtype} != {entry['dtype']}.")
+
+        f = self.files[(kind, name)]
+        chunk = np.ascontiguousarray(np.moveaxis(data, axis, 0))
+        if self.codec is not None:
+            payload = self.codec[1](chunk.tobytes())
+            entry["chunks"].append([f.tell(), len(payload), chunk.shape[0]])
+            f.write(payload)
+        else:
+            chunk.tofile(f)
+        entry["shape"][axis] += data.shape[axis]
+
+        if "scale_rows" in entry:
+            if scale is None:
+                raise ValueError(f"{kind}/{name}: quantized data needs a scale.")
+            self.append(f"{kind}_scales", name, scale.unsqueeze(axis), axis=axis)
+            entry["scale_rows"].append(data.shape[axis])
+
+    def put(self, kind: str, name: str, data: Union[torch.Tensor, np.ndarray]) -> None:
+        """
+        Write a whole entry at once, e.g. weights or predictions.
+        """
+        self.append(kind, name, data, axis=0)
+
+    def set_meta(self, key: str, value: Any) -> None:
+        self.manifest.setdefault("meta", {})[key] = value
+
+    def flush(self) -> None:
+        for f in self.files.values():
+            f.flush()
+
+        with open(os.path.join(self.root, self.MANIFEST), "w") as f:
+            json.dump(self.manifest, f, default=str)
+
+    def close(self) -> None:
+        if self.mode == "w":
+            self.flush()
+
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def keys(self, kind: str) -> List[str]:
+        return list(self.manifest.get(kind, {}))
+
+    def get(
+        self,
+        kind: str,
+        name: str,
+        samples: Optional[slice] = None,
+        dequantize: bool = True,
+    ) -> np.ndarray:
+        """
+        Memory-mapped view of `kind/name`, optionally restricted to a slice
+        along its streaming axis. Quantized entries are dequantized, or
+        with `dequantize=False` returned as the raw int8 data.
+        """
+        entry = self.manifest[kind][name]
+        axis = entry["axis"]
+        shape = list(entry["shape"])
+        disk_shape = [shape[axis]] + shape[:axis] + shape[axis + 1 :]
+
+        if shape[axis] == 0:
+            return np.empty(shape, dtype=entry["dtype"])
+
+        if "chunks" in entry:
+            data = self._read_chunks(entry, disk_shape, samples)
+        else:
+            data = np.memmap(
+                self._path(entry),
+                dtype=entry["dtype"],
+                mode="r",
+                offset=entry["offset"],
+                shape=tuple(disk_shape),
+            )
+            if samples is not None:
+                data = data[samples]
+
+        if entry.get("torch_dtype") == "bfloat16":
+            data = torch.from_numpy(np.array(data)).view(torch.bfloat16)
+            data = data.float().numpy()
+        if dequantize and "scale_rows" in entry:
+            data = self._dequantize(kind, name, entry, data, samples)
+
+        return np.moveaxis(data, 0, axis)
+
+    def _dequantize(
+        self,
+        kind: str,
+        name: str,
+        entry: Dict[str, Any],
+        data: np.ndarray,
+        samples: Optional[slice],
+    ) -> np.ndarray:
+        # per-append scales, streaming axis first like the data on disk
+        scales = self.get(f"{kind}_scales", name)
+        scales = np.moveaxis(scales, entry["axis"], 0)
+        batch = np.repeat(np.arange(len(entry["scale_rows"])), entry["scale_rows"])
+        if samples is not None:
+            batch = batch[samples]
+
+        return dequantize_per_channel(
+            torch.from_numpy(np.array(data)), torch.from_numpy(scales[batch])
+        ).numpy()
+
+    def get_quantized(self, kind: str, name: str) -> QuantizedCapture:
+        """
+        Raw int8 data of a quantized entry with its per-append scales.
+        """
+        entry = self.manifest[kind][name]
+        return QuantizedCapture(
+            self.get(kind, name, dequantize=False),
+            self.get(f"{kind}_scales", name),
+            entry["scale_rows"],
+            entry["axis"],
+        )
+
+    def _read_chunks(
+        self, entry: Dict[str, Any], disk_shape: List[int], samples: Optional[slice]
+    ) -> np.ndarray:
+        start, stop, step = (samples or slice(None)).indices(disk_shape[0])
+        decompress = get_codec(entry["compression"])[2]
+        parts, row = [], 0
+
+        with open(self._path(entry), "rb") as f:
+            for offset, nbytes, rows in entry["chunks"]:
+                if row < stop and row + rows > start:
+                    f.seek(offset)
+                    chunk = np.frombuffer(decompress(f.read(nbytes)), entry["dtype"])
+                    chunk = chunk.reshape(rows, *disk_shape[1:])
+                    parts.append(chunk[max(start - row, 0) : stop - row])
+                row += rows
+
+        data = np.concatenate(parts)
+        return data[::step] if step != 1 else data
+
+    def load(
+        self, kind: str, dequantize: bool = True
+    ) -> Dict[str, Union[np.ndarray, QuantizedCapture]]:
+        """
+        Lazily mapped views of every entry of `kind`; with `dequantize=False`
+        quantized entries are returned as `QuantizedCapture`.
+        """
+        entries = self.manifest.get(kind, {})
+        return {
+            name: (
+                self.get(kind, name)
+                if dequantize or "scale_rows" not in entry
+                else self.get_quantized(kind, name)
+            )
+            for name, entry in entries.items()
+        }
+
+    def meta(self, key: str) -> Any:
+        return self.manifest.get("meta", {}).get(key)
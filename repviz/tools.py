@@ -1,16 +1,89 @@
-from typing import Union
+from typing import Dict, Optional, Sequence, Union
 
 import torch
 import numpy as np
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
 
+from .cache import GramCache, fingerprint
+from .precision import QuantizedCapture
+from .projection import LandmarkTSNE, _num_rows, fit_projector
 
-def gram_linear(x):
+Array = Union[torch.Tensor, np.ndarray]
+
+
+def _to_numpy(x: Array) -> np.ndarray:
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+
+    return np.asarray(x)
+
+
+def _cast(x: Array, dtype: Optional[str]) -> Array:
+    if dtype is None:
+        return x
+    if isinstance(x, torch.Tensor):
+        return x.to(getattr(torch, dtype))
+
+    return x.astype(dtype)
+
+
+def _like(value: Array, ref: Array) -> Array:
+    # one cache serves numpy and torch callers on any device, and entries
+    # reloaded from disk come back as numpy arrays
+    if isinstance(ref, torch.Tensor):
+        if not isinstance(value, torch.Tensor):
+            value = torch.as_tensor(np.array(value))
+        return value.to(device=ref.device, dtype=ref.dtype)
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu().numpy()
+
+    return value.astype(ref.dtype, copy=False)
+
+
+def _norm(x: Array):
+    if isinstance(x, torch.Tensor):
+        return torch.linalg.norm(x)
+
+    return np.linalg.norm(x)
+
+
+def gram_linear(x, dtype: Optional[str] = None):
+    """
+    Linear Gram matrix `x @ x.T`, computed with the backend of `x`: NumPy,
+    or torch on the tensor's own device. `dtype` ("float32"/"float64")
+    selects the accumulation precision.
+    """
+    x = _cast(x, dtype)
     return x @ x.T
 
 
+def _center_gram_torch(gram: torch.Tensor, unbiased: bool = False) -> torch.Tensor:
+    if not torch.allclose(gram, gram.T):
+        raise ValueError("Input must be a symmetric matrix.")
+    gram = gram.clone()
+
+    if unbiased:
+        n = gram.shape[0]
+        gram.fill_diagonal_(0)
+        means = gram.sum(0, dtype=torch.float64) / (n - 2)
+        means -= means.sum() / (2 * (n - 1))
+        means = means.to(gram.dtype)
+        gram -= means[:, None]
+        gram -= means[None, :]
+        gram.fill_diagonal_(0)
+    else:
+        means = gram.mean(0, dtype=torch.float64)
+        means -= means.mean() / 2
+        means = means.to(gram.dtype)
+        gram -= means[:, None]
+        gram -= means[None, :]
+
+    return gram
+
+
 def center_gram(gram, unbiased=False):
+    if isinstance(gram, torch.Tensor):
+        return _center_gram_torch(gram, unbiased=unbiased)
+
     if not np.allclose(gram, gram.T):
         raise ValueError("Input must be a symmetric matrix.")
     gram = gram.copy()
@@ -32,28 +105,316 @@ def center_gram(gram, unbiased=False):
     return gram
 
 
-def cka(gram_x, gram_y, debiased=False):
-    gram_x = center_gram(gram_x, unbiased=debiased)
-    gram_y = center_gram(gram_y, unbiased=debiased)
+def _cached_center_gram(gram, unbiased=False, cache=None):
+    if cache is None:
+        return center_gram(gram, unbiased=unbiased)
+
+    key = f"{fingerprint(gram)}-center-{int(unbiased)}"
+    value = cache.get_or_compute(key, lambda: center_gram(gram, unbiased=unbiased))
+    return _like(value, gram)
+
+
+def cka(gram_x, gram_y, debiased=False, cache: Optional[GramCache] = None):
+    gram_x = _cached_center_gram(gram_x, unbiased=debiased, cache=cache)
+    gram_y = _cached_center_gram(gram_y, unbiased=debiased, cache=cache)
 
     scaled_hsic = gram_x.ravel().dot(gram_y.ravel())
 
-    normalization_x = np.linalg.norm(gram_x)
-    normalization_y = np.linalg.norm(gram_y)
+    normalization_x = _norm(gram_x)
+    normalization_y = _norm(gram_y)
     return scaled_hsic / (normalization_x * normalization_y)
 
 
+def _debiased_dot_product_similarity_helper(
+    xty, sum_squared_rows_dot, squared_norm_x, squared_norm_y, n
+):
+    """
+    Unbiased HSIC estimate from a biased one; `sum_squared_rows_dot` is the
+    dot product of the per-sample squared norms of the centered features.
+    """
+    return (
+        xty
+        - n / (n - 2.0) * sum_squared_rows_dot
+        + squared_norm_x * squared_norm_y / ((n - 1) * (n - 2))
+    )
+
+
+def _feature_space_cka_from_moments(
+    xty, xtx, yty, rows_xy, rows_xx, rows_yy, norm_x, norm_y, n, debiased
+) -> float:
+    dot_product_similarity = np.linalg.norm(xty) ** 2
+    normalization_x = np.linalg.norm(xtx)
+    normalization_y = np.linalg.norm(yty)
+
+    if debiased:
+        dot_product_similarity = _debiased_dot_product_similarity_helper(
+            dot_product_similarity, rows_xy, norm_x, norm_y, n
+        )
+        normalization_x = np.sqrt(
+            _debiased_dot_product_similarity_helper(
+                normalization_x**2, rows_xx, norm_x, norm_x, n
+            )
+        )
+        normalization_y = np.sqrt(
+            _debiased_dot_product_similarity_helper(
+                normalization_y**2, rows_yy, norm_y, norm_y, n
+            )
+        )
+
+    return dot_product_similarity / (normalization_x * normalization_y)
+
+
+def feature_space_cka(
+    features_x: Union[torch.Tensor, np.ndarray],
+    features_y: Union[torch.Tensor, np.ndarray],
+    debiased: bool = False,
+) -> float:
+    """
+    Linear CKA computed from centered cross-covariances, ||X^T Y||_F^2,
+    instead of n x n Gram matrices: O(n * d^2) time and O(d^2) memory.
+    Equal to `cka(gram_linear(x), gram_linear(y), debiased)`.
+    """
+    features_x = _to_numpy(_as_2d(features_x)).astype(np.float64)
+    features_y = _to_numpy(_as_2d(features_y)).astype(np.float64)
+    features_x = features_x - np.mean(features_x, 0, keepdims=True)
+    features_y = features_y - np.mean(features_y, 0, keepdims=True)
+
+    sum_squared_rows_x = np.einsum("ij,ij->i", features_x, features_x)
+    sum_squared_rows_y = np.einsum("ij,ij->i", features_y, features_y)
+
+    return _feature_space_cka_from_moments(
+        features_x.T @ features_y,
+        features_x.T @ features_x,
+        features_y.T @ features_y,
+        sum_squared_rows_x.dot(sum_squared_rows_y),
+        sum_squared_rows_x.dot(sum_squared_rows_x),
+        sum_squared_rows_y.dot(sum_squared_rows_y),
+        np.sum(sum_squared_rows_x),
+        np.sum(sum_squared_rows_y),
+        features_x.shape[0],
+        debiased,
+    )
+
+
+class StreamingLinearCKA:
+    """
+    Feature-space linear CKA accumulated over mini-batches.
+
+    Only raw (uncentered) moments are kept, O(d_x * d_y + d_x^2 + d_y^2)
+    memory, so batches can be fed straight from inference; centering with
+    the global means happens in `value()`. The result equals
+    `feature_space_cka` on the concatenated batches, debiased or not.
+    """
+
+    def __init__(self, debiased: bool = False) -> None:
+        self.debiased = debiased
+        self.n = 0
+        self.moments = {}
+
+    def _add(self, key: str, value) -> None:
+        if key in self.moments:
+            self.moments[key] += value
+        else:
+            self.moments[key] = value
+
+    def update(
+        self,
+        features_x: Union[torch.Tensor, np.ndarray],
+        features_y: Union[torch.Tensor, np.ndarray],
+    ) -> None:
+        x = _to_numpy(_as_2d(features_x)).astype(np.float64)
+        y = _to_numpy(_as_2d(features_y)).astype(np.float64)
+        if x.shape[0] != y.shape[0]:
+            raise ValueError("Batches must have the same number of samples.")
+
+        self.n += x.shape[0]
+        self._add("sx", x.sum(0))
+        self._add("sy", y.sum(0))
+        self._add("xtx", x.T @ x)
+        self._add("yty", y.T @ y)
+        self._add("xty", x.T @ y)
+
+        if self.debiased:
+            a = np.einsum("ij,ij->i", x, x)
+            b = np.einsum("ij,ij->i", y, y)
+            self._add("sa", a.sum())
+            self._add("sb", b.sum())
+            self._add("aa", a.dot(a))
+            self._add("bb", b.dot(b))
+            self._add("ab", a.dot(b))
+            self._add("ax", a @ x)
+            self._add("ay", a @ y)
+            self._add("bx", b @ x)
+            self._add("by", b @ y)
+
+    def _rows_dot(self, sa, sb, ab, av, bu, utv, mu, mv) -> float:
+        # sum_i ||u_i - mu||^2 * ||v_i - mv||^2 expanded in raw moments
+        nu, nv = mu.dot(mu), mv.dot(mv)
+        return (
+            ab
+            - 2 * mv.dot(av)
+            - 2 * mu.dot(bu)
+            + nv * sa
+            + nu * sb
+            + 4 * mu @ utv @ mv
+            - 3 * self.n * nu * nv
+        )
+
+    def value(self) -> float:
+        m, n = self.moments, self.n
+        mx, my = m["sx"] / n, m["sy"] / n
+        xty = m["xty"] - n * np.outer(mx, my)
+        xtx = m["xtx"] - n * np.outer(mx, mx)
+        yty = m["yty"] - n * np.outer(my, my)
+
+        if not self.debiased:
+            return _feature_space_cka_from_moments(
+                xty, xtx, yty, None, None, None, None, None, n, False
+            )
+
+        return _feature_space_cka_from_moments(
+            xty,
+            xtx,
+            yty,
+            self._rows_dot(
+                m["sa"], m["sb"], m["ab"], m["ay"], m["bx"], m["xty"], mx, my
+            ),
+            self._rows_dot(
+                m["sa"], m["sa"], m["aa"], m["ax"], m["ax"], m["xtx"], mx, mx
+            ),
+            self._rows_dot(
+                m["sb"], m["sb"], m["bb"], m["by"], m["by"], m["yty"], my, my
+            ),
+            np.trace(xtx),
+            np.trace(yty),
+            n,
+            True,
+        )
+
+
+def _as_2d(x: Array) -> Array:
+    # (n_calls, ..., n_samples, n_features) -> (n_samples, n_features)
+    if isinstance(x, QuantizedCapture):
+        x = x.dequantize()
+    if x.ndim <= 2:
+        return x
+    if isinstance(x, torch.Tensor):
+        return x.mean(dim=tuple(range(x.ndim - 2)))
+
+    return np.asarray(x).mean(axis=tuple(range(x.ndim - 2)))
+
+
+def centered_gram_linear(
+    x: Array,
+    debiased: bool = False,
+    cache: Optional[GramCache] = None,
+    dtype: Optional[str] = None,
+) -> Array:
+    """
+    Centered linear Gram matrix of activations `x`. With a `cache`, both the
+    Gram and its centered form are memoized by the fingerprint of `x`.
+    """
+    x = _cast(_as_2d(x), dtype)
+    if cache is None:
+        return center_gram(gram_linear(x), unbiased=debiased)
+
+    key = fingerprint(x)
+    gram = _like(cache.get_or_compute(f"{key}-gram", lambda: gram_linear(x)), x)
+    centered = cache.get_or_compute(
+        f"{key}-centered-{int(debiased)}",
+        lambda: center_gram(gram, unbiased=debiased),
+    )
+    return _like(centered, x)
+
+
+def _normalized_centered_grams(
+    mats: Sequence,
+    debiased: bool,
+    cache: Optional[GramCache] = None,
+    dtype: Optional[str] = None,
+) -> Array:
+    flat = []
+
+    for x in mats:
+        gram = centered_gram_linear(x, debiased=debiased, cache=cache, dtype=dtype)
+        flat.append(gram.ravel() / _norm(gram))
+
+    if isinstance(flat[0], torch.Tensor):
+        return torch.stack(flat)
+
+    return np.stack(flat)
+
+
+def _to_backend(mats: Sequence, backend: str, device: Optional[str]) -> list:
+    if backend == "numpy":
+        return [_to_numpy(x) for x in mats]
+    if backend == "torch":
+        return [torch.as_tensor(x, device=device) for x in mats]
+    if backend != "auto":
+        raise ValueError("backend must be 'auto', 'numpy' or 'torch'.")
+
+    return list(mats)
+
+
+def cka_matrix(
+    activations1: Union[Dict, Sequence],
+    activations2: Union[Dict, Sequence],
+    debiased: bool = False,
+    cache: Optional[GramCache] = None,
+    backend: str = "auto",
+    device: Optional[Union[torch.device, str]] = None,
+    dtype: Optional[str] = None,
+) -> Array:
+    """
+    Linear CKA between every layer of `activations1` (rows) and every layer
+    of `activations2` (columns).
+
+    Each layer's Gram matrix is built, centered and normalized once, and the
+    whole matrix is then a single product of the stacked, flattened grams.
+    Inputs with more than two dimensions are averaged over their leading
+    axes first, as in `plots.plot_cka`. Pass a `GramCache` to reuse the
+    grams of a fixed reference across calls.
+
+    With `backend="auto"` torch tensors stay torch tensors on their device
+    (multithreaded BLAS on CPU, or the accelerator) and the result is a
+    tensor; `"torch"` moves everything to `device` first and `"numpy"`
+    converts to NumPy. `dtype` ("float32"/"float64") selects the
+    accumulation precision.
+    """
+    same = activations2 is activations1
+    if isinstance(activations1, dict):
+        activations1 = list(activations1.values())
+    if isinstance(activations2, dict):
+        activations2 = list(activations2.values())
+
+    activations1 = _to_backend(activations1, backend, device)
+    grams1 = _normalized_centered_grams(activations1, debiased, cache, dtype)
+    if same:
+        grams2 = grams1
+    else:
+        activations2 = _to_backend(activations2, backend, device)
+        grams2 = _normalized_centered_grams(activations2, debiased, cache, dtype)
+
+    return grams1 @ grams2.T
+
+
 def decomposition(
-    mat: Union[torch.Tensor, np.ndarray], n_components: int, method: str = "PCA"
+    mat: Union[torch.Tensor, np.ndarray, Sequence[np.ndarray]],
+    n_components: int,
+    method: str = "PCA",
+    **kwargs,
 ) -> np.ndarray:
-    if isinstance(mat, torch.Tensor):
-        mat = np.array(mat)
+    """
+    Project the rows of `mat` to `n_components` dimensions with `"PCA"`,
+    `"IncrementalPCA"` or `"TSNE"`; see `projection.fit_projector` for the
+    options and the fitted-projector cache.
+    """
+    projector = fit_projector(mat, n_components, method=method, **kwargs)
 
-    decomposer = (
-        PCA(n_components=n_components)
-        if method == "PCA"
-        else TSNE(n_components=n_components)
-    )
-    decomposed_mat = decomposer.fit_transform(mat)
+    # every row was a t-SNE landmark: return the exact embedding
+    if isinstance(projector, LandmarkTSNE) and len(projector.embedding) == _num_rows(
+        mat
+    ):
+        return projector.embedding
 
-    return decomposed_mat
+    return projector.transform(mat)
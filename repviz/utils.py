@@ -1,9 +1,13 @@
 import re
 import ast
-from typing import Any, Dict
+import math
+from functools import lru_cache
+from typing import Any, Callable, Dict, Tuple
 
 from torch import nn
 
+from .index import get_model_index
+
 
 def tolist_dict(d: Dict[str, Any]) -> Dict[str, Any]:
     return {k: v.tolist() if hasattr(v, "tolist") else v for k, v in d.items()}
@@ -48,17 +52,118 @@ def parse_args_kwargs_from_repr(repr_str: str):
     return tuple(args), kwargs
 
 
-def get_model_info(model: nn.Module) -> Dict[str, Any]:
-    infos = {}
+def _is_config_value(value: Any) -> bool:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if isinstance(value, tuple):
+        return all(_is_config_value(v) for v in value)
+
+    return False
+
+
+def module_config(module: nn.Module) -> Dict[str, Any]:
+    """
+    Constructor-level configuration of a module, read from its public plain
+    attributes (`in_features`, `normalized_shape`, `p`, ...) instead of its
+    repr. `bias` records whether a bias parameter exists.
+    """
+    config = {
+        k: v
+        for k, v in vars(module).items()
+        if not k.startswith("_") and k != "training" and _is_config_value(v)
+    }
+    if "bias" in module._parameters:
+        config["bias"] = module._parameters["bias"] is not None
+
+    return config
+
+
+def _linear_flops(config: Dict[str, Any]) -> int:
+    flops = 2 * config["in_features"] * config["out_features"]
+    return flops + config["out_features"] * config.get("bias", False)
+
+
+def _norm_flops(config: Dict[str, Any]) -> int:
+    # mean, variance, normalize, scale and shift per element
+    return 5 * math.prod(config["normalized_shape"])
+
+
+# module class name -> forward FLOPs per sample (per row of the last axis)
+FLOP_ESTIMATES: Dict[str, Callable[[Dict[str, Any]], int]] = {
+    "Linear": _linear_flops,
+    "Bilinear": lambda c: 2 * c["in1_features"] * c["in2_features"] * c["out_features"],
+    "LayerNorm": _norm_flops,
+    "RMSNorm": _norm_flops,
+    "Embedding": lambda c: 0,
+}
+
 
-    for name, module in model.named_modules():
-        if len(list(module.children())) == 0:
-            args, kwargs = parse_args_kwargs_from_repr(str(module))
-            module_type = str(module).split("(")[0].strip()
-            infos[name] = {
-                "module_type": module_type,
-                "args": args,
-                "kwargs": kwargs,
-            }
+@lru_cache(maxsize=4096)
+def _leaf_info(
+    module_type: str, config: Tuple, params: Tuple, buffers: Tuple
+) -> Dict[str, Any]:
+    config = dict(config)
+    flops = FLOP_ESTIMATES.get(module_type)
+    try:
+        flops = flops(config) if flops is not None else None
+    except KeyError:
+        flops = None
+
+    return {
+        "module_type": module_type,
+        "config": config,
+        "param_shapes": {name: shape for name, shape, _ in params},
+        "params": sum(math.prod(shape) for _, shape, _ in params),
+        "param_bytes": sum(math.prod(shape) * size for _, shape, size in params),
+        "buffer_bytes": sum(math.prod(shape) * size for _, shape, size in buffers),
+        "flops_per_sample": flops,
+    }
+
+
+def _tensor_signature(tensors: Dict[str, Any]) -> Tuple:
+    return tuple(
+        (name, tuple(t.shape), t.element_size())
+        for name, t in tensors.items()
+        if t is not None
+    )
+
+
+def leaf_info(module: nn.Module) -> Dict[str, Any]:
+    """
+    Structured description of a leaf module: type, config, parameter shapes
+    and counts, parameter/buffer bytes and, for known types, the forward
+    FLOPs per sample (`None` when it depends on the input shape). Results
+    are cached per type, config and parameter signature, so repeated layers
+    and repeated calls are only described once.
+    """
+    info = _leaf_info(
+        module._get_name(),
+        tuple(module_config(module).items()),
+        _tensor_signature(module._parameters),
+        _tensor_signature(module._buffers),
+    )
+    return _copy_info(info)
+
+
+def _copy_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(
+        info, config=dict(info["config"]), param_shapes=dict(info["param_shapes"])
+    )
+
+
+def get_model_info(model: nn.Module, refresh: bool = False) -> Dict[str, Any]:
+    """
+    `leaf_info` of every leaf module plus its qualified `name`, keyed by the
+    same `Type:idx` alias as the hook captures (see `ModelIndex`).
+
+    The result is cached on the model index, which is rebuilt when the
+    model's structure changes; `refresh=True` forces a rebuild.
+    """
+    index = get_model_index(model, refresh=refresh)
+    if index.info is None:
+        index.info = {
+            entry.alias: dict(leaf_info(entry.module), name=entry.name)
+            for entry in index
+        }
 
-    return infos
+    return {alias: _copy_info(info) for alias, info in index.info.items()}